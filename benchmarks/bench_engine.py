@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp import YoutubeDL
+from yt_dlp.extractor.common import InfoExtractor
+from src.ytdlp_engine import build_format_string, build_ydl_opts, get_youtube_dl, download_with_engine
+from synthetic_media import make_synthetic_mp4
+
+# Сравнение накладных расходов на одно видео:
+#   subprocess - отдельный процесс на загрузку + повторный extract_info для метаданных (старое поведение)
+#   inprocess  - "прогретый" YoutubeDL в воркере, одна экстракция на видео
+
+PAYLOAD_SIZE = 256 * 1024
+
+class FakeIE(InfoExtractor):
+    IE_NAME = 'fake'
+    _VALID_URL = r'https?://fake\.local/watch/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        port = os.environ['FAKE_MEDIA_PORT']
+        return {
+            'id': video_id,
+            'title': f'Fake video {video_id}',
+            'formats': [{
+                'format_id': '144p',
+                'url': f'http://127.0.0.1:{port}/{video_id}.mp4',
+                'ext': 'mp4',
+                'height': 144,
+                'width': 256,
+                'vcodec': 'avc1',
+                'acodec': 'mp4a',
+            }],
+        }
+
+class MediaHandler(BaseHTTPRequestHandler):
+    payload = make_synthetic_mp4(PAYLOAD_SIZE)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_media_server():
+    server = HTTPServer(('127.0.0.1', 0), MediaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['FAKE_MEDIA_PORT'] = str(server.server_address[1])
+    return server
+
+def child_download(video_url, output_template, format_string):
+    ydl = YoutubeDL(build_ydl_opts(format_string), auto_init=False)
+    ydl.add_info_extractor(FakeIE())
+    ydl.params['outtmpl']['default'] = output_template
+    ydl.extract_info(video_url, download=True)
+
+def run_subprocess(video_urls, output_dir, format_string):
+    for i, video_url in enumerate(video_urls):
+        output_template = os.path.join(output_dir, f"sub{i}.%(ext)s")
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', video_url, output_template, format_string], check=True)
+        # Повторная экстракция ради названия, как в прежнем process_video_metadata
+        ydl = YoutubeDL({'quiet': True}, auto_init=False)
+        ydl.add_info_extractor(FakeIE())
+        ydl.extract_info(video_url, download=False)
+
+def run_inprocess(video_urls, output_dir, format_string):
+    get_youtube_dl(format_string, info_extractors=[FakeIE()])
+    for i, video_url in enumerate(video_urls):
+        output_template = os.path.join(output_dir, f"inproc{i}.%(ext)s")
+        file_path, info = download_with_engine(video_url, output_template, format_string, threading.Event(), None)
+        assert file_path and info['title']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=20)
+    parser.add_argument('--child', nargs=3)
+    args = parser.parse_args()
+
+    if args.child:
+        child_download(*args.child)
+        return
+
+    server = start_media_server()
+    format_string = build_format_string('144p')
+    video_urls = [f'http://fake.local/watch/vid{i}' for i in range(args.videos)]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, runner in (('subprocess', run_subprocess), ('inprocess', run_inprocess)):
+            start = time.perf_counter()
+            runner(video_urls, output_dir, format_string)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10}: {elapsed:.2f} s всего, {elapsed / len(video_urls) * 1000:.1f} ms на видео")
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
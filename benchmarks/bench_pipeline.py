@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import argparse
+import threading
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from src.downloader import download_videos
+from fake_rutube import start_rutube_server
+
+# Сквозной офлайн-бенчмарк download_videos: yt-dlp, ffprobe и API Rutube заменены
+# локальными заглушками, поэтому результаты воспроизводимы и сравнимы между коммитами.
+# Результаты дописываются в benchmarks/results/pipeline.jsonl вместе с хэшем коммита.
+
+FAKE_BIN_DIR = os.path.join(BENCH_DIR, 'fake_bin')
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results', 'pipeline.jsonl')
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def list_descendants(root_pid):
+    # Дерево процессов по /proc: воркеры пулов и запущенные ими yt-dlp/ffprobe
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        parents.setdefault(ppid, []).append(int(name))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(parents.get(pid, []))
+    return pids
+
+def read_process_usage(pid):
+    rss_kb = 0
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss_kb = int(line.split()[1])
+                    break
+        fds = len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        return 0, 0
+    return rss_kb, fds
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.peak_rss_kb = 0
+        self.peak_fds = 0
+        self.peak_processes = 0
+
+    def run(self):
+        if not os.path.isdir('/proc'):
+            return
+        while not self.stop_event.is_set():
+            pids = list_descendants(os.getpid())
+            usage = [read_process_usage(pid) for pid in pids]
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(rss for rss, _ in usage))
+            self.peak_fds = max(self.peak_fds, sum(fds for _, fds in usage))
+            self.peak_processes = max(self.peak_processes, len(pids))
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+def build_playlists(num_items, num_playlists, seed, long_tail=0):
+    rng = random.Random(seed)
+    playlists = {}
+    for index in range(num_items):
+        playlist_id = str(1000 + index % num_playlists)
+        # Последние long_tail видео - трехчасовые, в самом конце плейлистов
+        duration = 3 * 3600 if index >= num_items - long_tail else rng.randint(10, 3600)
+        playlists.setdefault(playlist_id, []).append({'id': f'bench{index:06d}', 'duration': duration})
+    return playlists
+
+def build_profile(playlists, args):
+    # Разброс размеров и длительности загрузок пропорционален длительности видео
+    mean_duration = sum(video['duration'] for videos in playlists.values() for video in videos) / max(1, sum(len(videos) for videos in playlists.values()))
+    profile = {}
+    for videos in playlists.values():
+        for video in videos:
+            scale = video['duration'] / mean_duration if args.skew else 1.0
+            profile[video['id']] = {'size': max(1024, int(args.size * scale)), 'latency': args.latency * scale}
+    return profile
+
+def build_config(work_dir, api_url, playlists_file, args):
+    return {
+        'output_dir': os.path.join(work_dir, 'output'),
+        'num_workers': args.workers,
+        'enumeration_workers': 4,
+        'probe_workers': args.probe_workers,
+        'stage_queue_size': 8,
+        'use_playlists': True,
+        'video_urls_file': os.path.join(work_dir, 'video_urls.txt'),
+        'playlists_file': playlists_file,
+        'video_quality': '144p',
+        'download_engine': 'subprocess',
+        'download_order': args.order,
+        'incremental_sync': True,
+        'logging': {'file_logging': False, 'console_logging': False, 'log_dir': os.path.join(work_dir, 'logs')},
+        'metadata': {'db_path': '', 'export_csv': True, 'json_files': False},
+        'probe_cache': {'enabled': True, 'path': ''},
+        'enumeration': {'cache_ttl': 0, 'page_workers': 4, 'rutube_api_url': api_url},
+        'rate_limit': {},
+        'retry': {'max_attempts': 2, 'base_delay': 0.1, 'max_delay': 1, 'throttle_pause': 0},
+        'metrics': {'enabled': True, 'report_dir': os.path.join(work_dir, 'report')},
+    }
+
+def run_once(config, num_items):
+    sampler = ResourceSampler()
+    sampler.start()
+    start = time.perf_counter()
+    download_videos(config)
+    wall_time = time.perf_counter() - start
+    sampler.stop()
+
+    with open(os.path.join(config['metrics']['report_dir'], 'run_report.json'), 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    succeeded = sum(1 for video in report['videos'] if video['success'])
+    return {
+        'wall_time': wall_time,
+        'items_per_s': num_items / wall_time if wall_time else 0.0,
+        'succeeded': succeeded,
+        'peak_rss_mb': sampler.peak_rss_kb / 1024,
+        'peak_fds': sampler.peak_fds,
+        'peak_processes': sampler.peak_processes,
+        'stages': {stage: {'p50': summary['p50'], 'p95': summary['p95'], 'sum': summary['sum']} for stage, summary in report['stages'].items()},
+    }
+
+def run_benchmark(num_items, args):
+    playlists = build_playlists(num_items, args.playlists, args.seed, args.long_tail)
+    server, api_url = start_rutube_server(playlists)
+    work_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        profile_path = os.path.join(work_dir, 'profile.json')
+        profile = build_profile(playlists, args)
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f)
+        playlists_file = os.path.join(work_dir, 'playlist_urls.txt')
+        with open(playlists_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(f'https://rutube.ru/plst/{playlist_id}/\n' for playlist_id in playlists))
+
+        if FAKE_BIN_DIR not in os.environ['PATH'].split(os.pathsep):
+            os.environ['PATH'] = FAKE_BIN_DIR + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_YTDLP_PROFILE'] = profile_path
+        os.environ['FAKE_FFPROBE_LATENCY'] = str(args.ffprobe_latency)
+
+        config = build_config(work_dir, api_url, playlists_file, args)
+        first = run_once(config, num_items)
+        # Повторный запуск по тем же плейлистам: все видео уже загружены
+        rerun = run_once(config, num_items)
+
+        simulated = sum(item['latency'] for item in profile.values())
+        # Нижняя граница времени загрузки: равномерно распределенная работа или самая длинная загрузка
+        ideal = max(simulated / args.workers, max(item['latency'] for item in profile.values()))
+        return {
+            'commit': get_git_commit(),
+            'timestamp': time.time(),
+            'items': num_items,
+            'playlists': len(playlists),
+            'workers': args.workers,
+            'probe_workers': args.probe_workers,
+            'size': args.size,
+            'latency': args.latency,
+            'ffprobe_latency': args.ffprobe_latency,
+            'skew': args.skew,
+            'order': args.order,
+            'long_tail': args.long_tail,
+            'first_run': first,
+            # Время первого запуска целиком и его превышение над нижней границей (хвост, когда заняты не все воркеры)
+            'makespan': first['wall_time'],
+            'makespan_excess': first['wall_time'] - ideal,
+            'rerun': rerun,
+            # Накладные расходы конвейера на видео сверх имитируемой загрузки, в пересчете на один воркер
+            'per_item_overhead_ms': (first['wall_time'] * args.workers - simulated) / num_items * 1000,
+            'rerun_per_item_ms': rerun['wall_time'] / num_items * 1000,
+            'self_maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'children_maxrss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def load_previous(results_path, result):
+    # Последний результат с теми же параметрами, но с другого коммита
+    if not os.path.isfile(results_path):
+        return None
+    keys = ('items', 'workers', 'probe_workers', 'size', 'latency', 'ffprobe_latency', 'skew', 'order', 'long_tail')
+    previous = None
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if all(entry.get(key) == result.get(key) for key in keys) and entry.get('commit') != result['commit']:
+                previous = entry
+    return previous
+
+def format_change(current, previous):
+    if not previous:
+        return ''
+    return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+def print_result(result, previous):
+    first, rerun = result['first_run'], result['rerun']
+    prev_first = previous['first_run'] if previous else {}
+    prev_rerun = previous['rerun'] if previous else {}
+    print(f"{result['items']} видео, коммит {result['commit']}" + (f", сравнение с {previous['commit']}" if previous else ''))
+    print(f"  первый запуск: {first['wall_time']:.2f} с{format_change(first['wall_time'], prev_first.get('wall_time'))}, "
+          f"{first['items_per_s']:.1f} видео/с, успешно {first['succeeded']}")
+    print(f"  makespan ({result['order']}): {result['makespan']:.2f} с{format_change(result['makespan'], previous and previous.get('makespan'))}, "
+          f"сверх нижней границы {result['makespan_excess']:.2f} с")
+    print(f"  накладные расходы на видео: {result['per_item_overhead_ms']:.1f} ms"
+          f"{format_change(result['per_item_overhead_ms'], previous and previous['per_item_overhead_ms'])}")
+    print(f"  повторный запуск: {rerun['wall_time']:.2f} с{format_change(rerun['wall_time'], prev_rerun.get('wall_time'))}, "
+          f"{result['rerun_per_item_ms']:.2f} ms на видео")
+    print(f"  пик RSS: {first['peak_rss_mb']:.0f} MB, пик дескрипторов: {first['peak_fds']}, пик процессов: {first['peak_processes']}")
+    for stage, summary in sorted(first['stages'].items()):
+        print(f"    {stage:>14}: p50 {summary['p50'] * 1000:.1f} ms, p95 {summary['p95'] * 1000:.1f} ms, всего {summary['sum']:.2f} с")
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера загрузки")
+    parser.add_argument('--items', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--playlists', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--probe-workers', type=int, default=2)
+    parser.add_argument('--size', type=int, default=64 * 1024, help="Средний размер файла в байтах")
+    parser.add_argument('--latency', type=float, default=0.05, help="Средняя длительность загрузки в секундах")
+    parser.add_argument('--ffprobe-latency', type=float, default=0.0)
+    parser.add_argument('--skew', action='store_true', help="Размер и длительность загрузки пропорциональны длительности видео")
+    parser.add_argument('--long-tail', type=int, default=0, help="Сколько трехчасовых видео в конце плейлистов (вместе с --skew)")
+    parser.add_argument('--order', choices=('lpt', 'fifo'), default='lpt', help="Порядок раздачи загрузок (download_order)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    for num_items in args.items:
+        result = run_benchmark(num_items, args)
+        print_result(result, load_previous(args.results, result))
+        if not args.no_save:
+            os.makedirs(os.path.dirname(args.results), exist_ok=True)
+            with open(args.results, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from src.metadata_utils import get_file_metadata
+from synthetic_media import write_synthetic_mp4, make_synthetic_moov
+from bench_pipeline import FAKE_BIN_DIR, get_git_commit, format_change
+
+# Бенчмарк get_file_metadata: чтение заголовка mp4 (metadata.mp4_reader) против запуска ffprobe
+# на синтетических файлах. Параметры moov совпадают с выводом заглушки ffprobe, поэтому оба пути
+# должны вернуть одинаковые словари. Кэш ffprobe отключен: измеряется каждый вызов.
+# Результаты дописываются в benchmarks/results/probe.jsonl.
+
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results', 'probe.jsonl')
+
+def build_config(work_dir, mp4_reader):
+    return {
+        'output_dir': work_dir,
+        'logging': {'file_logging': False, 'console_logging': False, 'log_dir': os.path.join(work_dir, 'logs')},
+        'metadata': {'mp4_reader': mp4_reader},
+        'probe_cache': {'enabled': False},
+    }
+
+def measure_path(file_paths, config, repeat):
+    timings = []
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [get_file_metadata(file_path, config) for file_path in file_paths]
+        timings.append((time.perf_counter() - start) / len(file_paths))
+    return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings)}, results
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='bench_probe_')
+    os.environ['PATH'] = FAKE_BIN_DIR + os.pathsep + os.environ['PATH']
+    try:
+        moov = make_synthetic_moov()
+        file_paths = []
+        for index in range(args.files):
+            file_path = os.path.join(work_dir, f'probe{index:04d}.mp4')
+            write_synthetic_mp4(file_path, args.file_size, moov=moov)
+            file_paths.append(file_path)
+
+        mp4_reader, mp4_results = measure_path(file_paths, build_config(work_dir, True), args.repeat)
+        ffprobe, ffprobe_results = measure_path(file_paths, build_config(work_dir, False), args.repeat)
+        return {
+            'commit': get_git_commit(),
+            'timestamp': time.time(),
+            'files': args.files,
+            'file_size': args.file_size,
+            'mp4_reader': mp4_reader,
+            'ffprobe': ffprobe,
+            'speedup': ffprobe['median'] / mp4_reader['median'],
+            'results_match': mp4_results == ffprobe_results,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def load_previous(results_path, result):
+    if not os.path.isfile(results_path):
+        return None
+    previous = None
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('files') == result['files'] and entry.get('file_size') == result['file_size'] and entry.get('commit') != result['commit']:
+                previous = entry
+    return previous
+
+def print_result(result, previous):
+    print(f"Метаданные файла: {result['files']} файлов по {result['file_size'] / 1024 / 1024:.1f} MB, коммит {result['commit']}" + (f", сравнение с {previous['commit']}" if previous else ''))
+    for name, title in (('mp4_reader', 'заголовок mp4'), ('ffprobe', 'ffprobe')):
+        timing = result[name]
+        previous_median = previous[name]['median'] if previous else None
+        print(f"  {title:>14}: медиана {timing['median'] * 1000:.3f} ms/файл{format_change(timing['median'], previous_median)}, "
+              f"min {timing['min'] * 1000:.3f} ms, max {timing['max'] * 1000:.3f} ms")
+    print(f"  ускорение: x{result['speedup']:.0f}")
+    print(f"  результаты совпадают с ffprobe: {'да' if result['results_match'] else 'НЕТ'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк чтения метаданных mp4 без ffprobe")
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-size', type=int, default=16 * 1024 * 1024, help="Размер синтетического файла в байтах")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_result(result, load_previous(args.results, result))
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+if __name__ == '__main__':
+    main()
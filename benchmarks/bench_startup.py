@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from synthetic_media import write_synthetic_mp4
+from bench_pipeline import FAKE_BIN_DIR, get_git_commit, format_change
+
+# Бенчмарк запуска: время импорта пакета и время пробного запуска (main.py --dry-run)
+# по списку отдельных видео, часть из которых уже загружена. Команды планирования
+# не должны загружать yt_dlp, requests, bs4 и ffprobe и укладываться в TARGET_SECONDS.
+# Результаты дописываются в benchmarks/results/startup.jsonl.
+
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results', 'startup.jsonl')
+HEAVY_MODULES = ('yt_dlp', 'requests', 'bs4', 'ffprobe', 'tqdm')
+TARGET_SECONDS = 1.0
+
+def measure_command(command, env, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings)}
+
+def get_loaded_heavy_modules(env):
+    # Какие тяжелые модули загружает сам импорт пакета
+    code = f"import sys, src; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True).stdout.strip()
+    return output.split(',') if output else []
+
+def build_library(work_dir, num_items, num_existing):
+    output_dir = os.path.join(work_dir, 'output')
+    videos_dir = os.path.join(output_dir, 'individual_videos')
+    os.makedirs(videos_dir)
+    video_urls_file = os.path.join(work_dir, 'video_urls.txt')
+    with open(video_urls_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(f'https://rutube.ru/video/startup{index:06d}/\n' for index in range(num_items)))
+    for index in range(num_existing):
+        write_synthetic_mp4(os.path.join(videos_dir, f'startup{index:06d}.mp4'), 4096)
+
+    config = {
+        'output_dir': output_dir,
+        'num_workers': 4,
+        'use_playlists': False,
+        'video_urls_file': video_urls_file,
+        'playlists_file': os.path.join(work_dir, 'playlist_urls.txt'),
+        'video_quality': '720p',
+        'incremental_sync': True,
+        'logging': {'file_logging': False, 'console_logging': False, 'log_dir': os.path.join(work_dir, 'logs')},
+        'probe_cache': {'enabled': True, 'path': ''},
+    }
+    config_path = os.path.join(work_dir, 'config.yaml')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return config_path
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    env = dict(os.environ, PATH=FAKE_BIN_DIR + os.pathsep + os.environ['PATH'])
+    try:
+        config_path = build_library(work_dir, args.items, args.existing)
+        dry_run = [sys.executable, 'main.py', '--config', config_path, '--dry-run']
+        # Первый пробный запуск заполняет кэш ffprobe для уже загруженных файлов
+        subprocess.run(dry_run, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        return {
+            'commit': get_git_commit(),
+            'timestamp': time.time(),
+            'items': args.items,
+            'existing': args.existing,
+            'python': measure_command([sys.executable, '-c', 'pass'], env, args.repeat),
+            'import': measure_command([sys.executable, '-c', 'import src'], env, args.repeat),
+            'dry_run': measure_command(dry_run, env, args.repeat),
+            'heavy_modules': get_loaded_heavy_modules(env),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def load_previous(results_path, result):
+    if not os.path.isfile(results_path):
+        return None
+    previous = None
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('items') == result['items'] and entry.get('existing') == result['existing'] and entry.get('commit') != result['commit']:
+                previous = entry
+    return previous
+
+def print_result(result, previous):
+    print(f"Запуск: {result['items']} видео, из них загружено {result['existing']}, коммит {result['commit']}" + (f", сравнение с {previous['commit']}" if previous else ''))
+    for name, title in (('python', 'пустой интерпретатор'), ('import', 'import src'), ('dry_run', 'main.py --dry-run')):
+        timing = result[name]
+        previous_median = previous[name]['median'] if previous else None
+        print(f"  {title:>22}: медиана {timing['median'] * 1000:.0f} ms{format_change(timing['median'], previous_median)}, "
+              f"min {timing['min'] * 1000:.0f} ms, max {timing['max'] * 1000:.0f} ms")
+    print(f"  тяжелые модули при импорте: {', '.join(result['heavy_modules']) or 'нет'}")
+    status = 'OK' if result['dry_run']['median'] < TARGET_SECONDS else 'МЕДЛЕННО'
+    print(f"  пробный запуск быстрее {TARGET_SECONDS:.1f} с: {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени запуска и пробного запуска")
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--existing', type=int, default=200, help="Сколько видео из списка уже загружено")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_result(result, load_previous(args.results, result))
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import re
+import json
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Локальная замена API плейлистов Rutube: постраничная выдача с has_next и ETag,
+# а также HTML страница плейлиста для запасного разбора
+
+PAGE_SIZE = 20
+API_PATH = re.compile(r'^/api/playlist/custom/(?P<playlist_id>\d+)/videos/?$')
+HTML_PATH = re.compile(r'^/plst/(?P<playlist_id>\d+)/?$')
+
+class RutubeHandler(BaseHTTPRequestHandler):
+    playlists = {}
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        api_match = API_PATH.match(parsed_url.path)
+        html_match = HTML_PATH.match(parsed_url.path)
+        match = api_match or html_match
+        if not match or match.group('playlist_id') not in self.playlists:
+            self._send(404)
+            return
+
+        videos = self.playlists[match.group('playlist_id')]
+        if html_match:
+            links = ''.join(f'<a href="/video/{video["id"]}/">{video["id"]}</a>' for video in videos)
+            self._send(200, f'<html><body>{links}</body></html>'.encode('utf-8'), 'text/html')
+            return
+
+        etag = '"' + hashlib.sha1(json.dumps(videos).encode('utf-8')).hexdigest() + '"'
+        page = int(parse_qs(parsed_url.query).get('page', ['1'])[0])
+        if page == 1 and self.headers.get('If-None-Match') == etag:
+            self._send(304, headers={'ETag': etag})
+            return
+
+        results = videos[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        # Как и настоящий API, страницы за последней отдают 404
+        if page > 1 and not results:
+            self._send(404)
+            return
+        body = json.dumps({
+            'page': page,
+            'per_page': PAGE_SIZE,
+            'has_next': page * PAGE_SIZE < len(videos),
+            'results': [
+                {'id': video['id'], 'video_url': f'https://rutube.ru/video/{video["id"]}/', 'duration': video.get('duration')}
+                for video in results
+            ],
+        }).encode('utf-8')
+        self._send(200, body, headers={'ETag': etag})
+
+    def log_message(self, format, *args):
+        pass
+
+def start_rutube_server(playlists):
+    # playlists: {playlist_id: [{'id': ..., 'duration': ...}, ...]}
+    RutubeHandler.playlists = playlists
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RutubeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_address[1]}/api/playlist/custom/{{playlist_id}}/videos?page={{page}}&format=json'
+    return server, api_url
@@ -0,0 +1,46 @@
+import os
+import struct
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def _full_box(box_type, payload, version=0):
+    return _box(box_type, struct.pack('>I', version << 24) + payload)
+
+def _track(track_id, handler, timescale, duration, samples, sample_entry, tkhd_size):
+    tkhd = _full_box(b'tkhd', struct.pack('>IIIII8xhhhH36xII', 0, 0, track_id, 0, duration, 0, 0, 0, 0, tkhd_size[0] << 16, tkhd_size[1] << 16))
+    mdhd = _full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55c4, 0))
+    hdlr = _full_box(b'hdlr', struct.pack('>I4s12x', 0, handler) + b'\0')
+    stsd = _full_box(b'stsd', struct.pack('>I', 1) + sample_entry)
+    stsz = _full_box(b'stsz', struct.pack('>II', 1000, samples))
+    stbl = _box(b'stbl', stsd + _full_box(b'stts', struct.pack('>I', 0)) + stsz)
+    return _box(b'trak', tkhd + _box(b'mdia', mdhd + hdlr + _box(b'minf', stbl)))
+
+def make_synthetic_moov(width=256, height=144, fps=25, duration=10.0, sample_rate=44100, channels=2):
+    # moov с видео (avc1) и аудио (mp4a) дорожками, как у файлов после слияния форматов yt-dlp
+    video_entry = _box(b'avc1', struct.pack('>6xH2x2x12xHHIIIH32sHh', 1, width, height, 0x480000, 0x480000, 0, 1, b'', 24, -1))
+    audio_entry = _box(b'mp4a', struct.pack('>6xHHHIHHHHI', 1, 0, 0, 0, channels, 16, 0, 0, sample_rate << 16))
+    mvhd = _full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, int(duration * 1000)) + bytes(80))
+    return _box(b'moov', mvhd
+                + _track(1, b'vide', 12800, int(duration * 12800), int(duration * fps), video_entry, (width, height))
+                + _track(2, b'soun', sample_rate, int(duration * sample_rate), -(-int(duration * sample_rate) // 1024), audio_entry, (0, 0)))
+
+def make_synthetic_mp4(size, moov=None):
+    # Минимальная структура боксов (ftyp, moov, mdat), проходящая проверку контейнера
+    ftyp = struct.pack('>I4s4sI4s', 20, b'ftyp', b'isom', 512, b'isom')
+    moov = moov or struct.pack('>I4s', 8, b'moov')
+    mdat_size = max(size - len(ftyp) - len(moov), 8)
+    return ftyp + moov + struct.pack('>I4s', mdat_size, b'mdat') + os.urandom(mdat_size - 8)
+
+def write_synthetic_mp4(path, size, chunk_size=1024 * 1024, moov=None):
+    # Большие файлы пишутся потоком, без построения всего содержимого в памяти
+    ftyp = struct.pack('>I4s4sI4s', 20, b'ftyp', b'isom', 512, b'isom')
+    moov = moov or struct.pack('>I4s', 8, b'moov')
+    mdat_size = max(size - len(ftyp) - len(moov), 8)
+    with open(path, 'wb') as f:
+        f.write(ftyp + moov + struct.pack('>I4s', mdat_size, b'mdat'))
+        remaining = mdat_size - 8
+        chunk = os.urandom(min(chunk_size, remaining)) if remaining else b''
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
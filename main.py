@@ -1,12 +1,20 @@
 import os
-from src import read_config, download_videos, setup_logging
+import argparse
+from src import read_config, download_videos, list_download_plan, verify_library, setup_logging
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка видео и плейлистов YouTube и Rutube")
+    parser.add_argument('--dry-run', action='store_true', help="Показать план загрузки по каждому видео без загрузки")
+    parser.add_argument('--verify', action='store_true', help="Проверить целостность загруженных файлов и сохранить список видео для повторной загрузки")
+    parser.add_argument('--watch', action='store_true', help="Режим наблюдения: работать до SIGTERM, добавляя новые видео из файла со списком URL и из плейлистов")
+    parser.add_argument('--config', help="Путь к файлу конфигурации (по умолчанию config.yaml рядом с main.py)")
+    args = parser.parse_args()
+
     # Получаем абсолютный путь к директории, где находится main.py
     base_dir = os.path.dirname(os.path.abspath(__file__))
 
     # Формируем полный путь к файлу конфигурации
-    config_path = os.path.join(base_dir, 'config.yaml')
+    config_path = args.config or os.path.join(base_dir, 'config.yaml')
 
     # Читаем конфигурацию
     config = read_config(config_path)
@@ -16,7 +24,12 @@ if __name__ == "__main__":
 
     # Запускаем процесс загрузки видео
     try:
-        download_videos(config)
+        if args.verify:
+            verify_library(config)
+        elif args.dry_run:
+            list_download_plan(config)
+        else:
+            download_videos(config, watch=args.watch)
     except KeyboardInterrupt:
         logger.info("Программа была прервана пользователем.")
     except Exception as e:
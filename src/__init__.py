@@ -1,10 +1,12 @@
 from .config import read_config
 from .url_utils import get_playlist_id, get_video_id, read_video_urls, get_rutube_playlist_video_ids
-from .downloader import download_videos
+from .downloader import download_videos, list_download_plan
+from .verify import verify_library
 from .logging_utils import setup_logging, filter_yt_dlp_output
 from .file_utils import create_file_index, find_existing_file
 from .subprocess_utils import subprocess_run_context
 from .metadata_utils import update_metadata_to_csv, process_video_metadata, get_file_metadata, cleanup_info_json_files
+from .metadata_store import upsert_metadata_batch, export_metadata_to_csv
 
 __all__ = [
     'read_config',
@@ -13,6 +15,8 @@ __all__ = [
     'read_video_urls',
     'get_rutube_playlist_video_ids',
     'download_videos',
+    'list_download_plan',
+    'verify_library',
     'setup_logging',
     'create_file_index',
     'find_existing_file',
@@ -21,5 +25,7 @@ __all__ = [
     'update_metadata_to_csv',
     'process_video_metadata',
     'get_file_metadata',
-    'cleanup_info_json_files'
+    'cleanup_info_json_files',
+    'upsert_metadata_batch',
+    'export_metadata_to_csv'
 ]
@@ -0,0 +1,77 @@
+import os
+import time
+import shutil
+
+# Допуск загрузок по свободному месту: планировщик не отдает воркерам новую загрузку, пока на томе
+# области загрузки (scratch_dir) или выходной директории свободно меньше, чем ожидаемый размер
+# идущих загрузок вместе с новой плюс запас. Загрузка ждет в очереди стадии, а не обрывается на середине.
+
+MB = 1024 * 1024
+# Пока идет слияние, на томе области загрузки лежат и части форматов, и результат
+STAGING_FACTOR = 2
+WARNING_INTERVAL = 60
+
+class DiskSpaceAdmission:
+    def __init__(self, volumes, margin, default_size, logger, stage='download'):
+        # volumes - список (путь на томе, множитель ожидаемого размера)
+        self.volumes = volumes
+        self.margin = margin
+        self.default_size = default_size
+        self.logger = logger
+        self.stage = stage
+        self.reserved = {}
+        self.counter = 0
+        self.warned_at = 0.0
+
+    def _expected_size(self, job):
+        return job.get('expected_size') or self.default_size
+
+    def admit(self, job):
+        # Получение информации о видео и планирование без загрузки места не требуют
+        if job.get('action') in ('info', 'plan'):
+            return True
+        size = self._expected_size(job)
+        reserved = sum(self.reserved.values())
+        for path, factor in self.volumes:
+            free = shutil.disk_usage(path).free
+            needed = factor * (reserved + size) + self.margin
+            if free < needed:
+                if not self.reserved:
+                    # Место уже не освободится завершением других загрузок: ожидание длилось бы вечно,
+                    # поэтому загрузка допускается одна, а нехватку места покажет ее ошибка
+                    self.logger.warning(f"Недостаточно свободного места на {path}: свободно {free / MB:.0f} MB, "
+                                        f"нужно {needed / MB:.0f} MB, но других загрузок нет. Загрузка {job.get('video_id')} запускается одна.")
+                    break
+                now = time.monotonic()
+                if now - self.warned_at >= WARNING_INTERVAL:
+                    self.warned_at = now
+                    self.logger.warning(f"Недостаточно свободного места на {path}: свободно {free / MB:.0f} MB, "
+                                        f"нужно {needed / MB:.0f} MB. Новые загрузки ждут освобождения места (идет загрузок: {len(self.reserved)}).")
+                return False
+        self.counter += 1
+        job['reservation'] = self.counter
+        self.reserved[self.counter] = size
+        return True
+
+    def release(self, job):
+        self.reserved.pop(job.pop('reservation', None), None)
+
+def create_disk_admission(config, logger):
+    storage_config = config.get('storage', {})
+    if not storage_config.get('admission', True):
+        return None
+    output_dir = config['output_dir']
+    scratch_dir = storage_config.get('scratch_dir')
+    if scratch_dir:
+        os.makedirs(scratch_dir, exist_ok=True)
+    if scratch_dir and os.stat(scratch_dir).st_dev != os.stat(output_dir).st_dev:
+        volumes = [(scratch_dir, STAGING_FACTOR), (output_dir, 1)]
+    else:
+        # Область загрузки на том же томе: готовый файл переносится переименованием, без копии
+        volumes = [(output_dir, STAGING_FACTOR)]
+    return DiskSpaceAdmission(
+        volumes,
+        storage_config.get('free_space_margin', 1024) * MB,
+        storage_config.get('default_video_size', 300) * MB,
+        logger
+    )
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from .file_utils import get_file_index, update_file_index, commit_staged_file
+
+# Общее хранилище загруженных видео с ключом (платформа, id): <store_dir>/<платформа>/<id>.<ext>.
+# Папки плейлистов заполняются жесткими ссылками на файлы хранилища (символическими, если
+# жесткая ссылка невозможна), поэтому видео из нескольких плейлистов загружается и анализируется один раз.
+
+def is_dedup_enabled(config):
+    return config.get('dedup', {}).get('enabled', False)
+
+def get_store_dir(config, platform):
+    store_dir = os.path.join(config.get('dedup', {}).get('store_dir') or os.path.join(config['output_dir'], '.store'), platform)
+    os.makedirs(store_dir, exist_ok=True)
+    return store_dir
+
+def find_store_file(config, platform, video_id, logger, use_index=True):
+    store_dir = get_store_dir(config, platform)
+    # Воркеры проверяют файл напрямую: индекс родительского процесса не видит их свежих загрузок
+    if use_index:
+        file_name = get_file_index(store_dir, logger).get(video_id)
+        return os.path.join(store_dir, file_name) if file_name else None
+    # Расширение зависит от выбранного формата (.mp4, .webm, .mkv), поэтому файл ищется по id
+    with os.scandir(store_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[0] == video_id:
+                return entry.path
+    return None
+
+def link_from_store(store_path, output_dir, logger):
+    target_path = os.path.join(output_dir, os.path.basename(store_path))
+    try:
+        if os.path.samefile(store_path, target_path):
+            return target_path
+        os.remove(target_path)
+    except OSError:
+        pass
+
+    try:
+        os.link(store_path, target_path)
+        return target_path
+    except OSError as e:
+        logger.debug(f"Жесткая ссылка на {store_path} невозможна: {e}")
+    try:
+        os.symlink(os.path.abspath(store_path), target_path)
+        return target_path
+    except OSError as e:
+        logger.warning(f"Ссылка на {store_path} невозможна ({e}), файл будет скопирован")
+    shutil.copy2(store_path, target_path)
+    return target_path
+
+def _get_info_path(config, platform, video_id):
+    return os.path.join(get_store_dir(config, platform), '.info', f"{video_id}.json")
+
+def commit_to_store(staged_path, config, platform, video_id, info=None):
+    store_path = commit_staged_file(staged_path, get_store_dir(config, platform), video_id)
+    update_file_index(store_path)
+    if info:
+        # Краткая информация о видео рядом с файлом: другим плейлистам не нужно запрашивать ее повторно
+        info_path = _get_info_path(config, platform, video_id)
+        os.makedirs(os.path.dirname(info_path), exist_ok=True)
+        tmp_path = f"{info_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        os.replace(tmp_path, info_path)
+    return store_path
+
+def get_store_info(config, platform, video_id):
+    try:
+        with open(_get_info_path(config, platform, video_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def adopt_into_store(file_path, config, platform, video_id):
+    # Файл, загруженный до включения хранилища, становится его содержимым без копирования
+    store_path = os.path.join(get_store_dir(config, platform), os.path.basename(file_path))
+    if os.path.islink(file_path) or os.path.exists(store_path):
+        return None
+    try:
+        os.link(file_path, store_path)
+    except OSError:
+        return None
+    update_file_index(store_path)
+    return store_path
+
+def _refresh_lock(lock_path, interval, stop_event):
+    # Держатель блокировки обновляет время изменения файла, чтобы долгая загрузка не считалась брошенной
+    while not stop_event.wait(interval):
+        try:
+            os.utime(lock_path)
+        except OSError:
+            pass
+
+@contextmanager
+def store_lock(config, platform, video_id):
+    # Файл-блокировка (O_EXCL работает и на Windows, и на общих файловых системах): одно видео
+    # одновременно загружает только один воркер. Блокировка не ждет: если видео уже загружается,
+    # возвращается False и задача откладывается, не занимая слот загрузки
+    lock_path = os.path.join(get_store_dir(config, platform), f".{video_id}.lock")
+    stale_after = config.get('dedup', {}).get('lock_timeout', 120)
+    fd = None
+    while fd is None:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) <= stale_after:
+                    break
+                os.remove(lock_path)
+            except OSError:
+                pass
+    if fd is None:
+        yield False
+        return
+
+    stop_event = threading.Event()
+    refresher = threading.Thread(target=_refresh_lock, args=(lock_path, max(1, stale_after / 4), stop_event), daemon=True)
+    refresher.start()
+    try:
+        yield True
+    finally:
+        stop_event.set()
+        refresher.join()
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
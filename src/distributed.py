@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+
+# Распределенный режим: каждый узел перечисляет плейлисты и публикует задачи в общую очередь
+# (повторная публикация идемпотентна), а затем забирает задачи пачками под аренду.
+# Пока узел держит задачи, отдельный поток продлевает аренду. Узел завершает работу,
+# когда в очереди не осталось ни свободных, ни арендованных задач: если другой узел
+# упадет, его задачи заберет один из оставшихся после истечения аренды.
+class DistributedFeed:
+    def __init__(self, job_queue, config, logger, interrupt_event, add_batch_fn):
+        distributed_config = config.get('distributed', {})
+        self.job_queue = job_queue
+        self.logger = logger
+        self.interrupt_event = interrupt_event
+        # add_batch_fn(output_dir, video_urls, estimates, done_fn, committed_fn) добавляет пачку задач в планировщик
+        self.add_batch_fn = add_batch_fn
+        self.base_dir = config['output_dir']
+        self.batch_size = distributed_config.get('batch_size', 20)
+        self.max_claims = distributed_config.get('max_claims', 3)
+        self.poll_interval = distributed_config.get('poll_interval', 5)
+        self.heartbeat_interval = max(1.0, distributed_config.get('lease_seconds', 300) / 3)
+        self.held = 0
+        self.claimed_total = 0
+        self.polled_at = 0.0
+        self.queue_empty = False
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+
+    def _to_queue_dir(self, output_dir):
+        # В очереди хранится путь относительно output_dir: на узлах общая папка может быть смонтирована по-разному
+        return os.path.relpath(output_dir, self.base_dir)
+
+    def _from_queue_dir(self, queue_dir):
+        return os.path.join(self.base_dir, queue_dir)
+
+    def publish(self, output_dir, video_urls, estimates=None):
+        # Оценки размеров публикуются вместе с задачами: пачку может взять узел, не перечислявший плейлист
+        self.job_queue.add_tasks(self._to_queue_dir(output_dir), video_urls, estimates)
+        self.queue_empty = False
+        self.logger.info(f"Опубликовано {len(video_urls)} задач для {output_dir} в общей очереди")
+        return []
+
+    def start(self):
+        self.logger.info(f"Проход синхронизации в общей очереди: {self.job_queue.run_id}")
+        self.heartbeat_thread.start()
+
+    def stop(self, interrupted=False):
+        self.stop_event.set()
+        self.heartbeat_thread.join()
+        if interrupted:
+            self.job_queue.release_all()
+        self.job_queue.close()
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(self.heartbeat_interval):
+            if self.held:
+                try:
+                    self.job_queue.heartbeat()
+                except Exception as e:
+                    self.logger.error(f"Не удалось продлить аренду задач: {e}")
+
+    def poll(self, free_slots):
+        now = time.monotonic()
+        if free_slots <= 0 or (self.queue_empty and now - self.polled_at < self.poll_interval):
+            return
+        self.polled_at = now
+        rows = self.job_queue.claim(min(free_slots, self.batch_size), self.max_claims)
+        if not rows:
+            self.queue_empty = True
+            return
+        self.held += len(rows)
+        self.claimed_total += len(rows)
+        batches = {}
+        for queue_dir, video_url, estimate in rows:
+            video_urls, estimates = batches.setdefault(queue_dir, ([], {}))
+            video_urls.append(video_url)
+            if estimate:
+                estimates[video_url] = estimate
+        for queue_dir, (video_urls, estimates) in batches.items():
+            committed = []
+            self.add_batch_fn(
+                self._from_queue_dir(queue_dir), video_urls, estimates,
+                lambda job, committed=committed: self.on_done(job, committed),
+                lambda committed=committed: self.on_batch_committed(committed)
+            )
+
+    def on_done(self, job, committed):
+        if job.get('success'):
+            # Успешная задача отмечается в очереди только после записи метаданных пачки
+            committed.append(job)
+            return
+        self.held -= 1
+        if self.interrupt_event.is_set():
+            # Прерванная задача сразу возвращается в очередь для других узлов без расхода лимита выдач
+            self.job_queue.release(self._to_queue_dir(job['output_dir']), job['video_url'])
+            return
+        if job.get('next') in ('dead', 'retry'):
+            # Неустранимая ошибка или исчерпаны попытки повтора
+            state = 'dead'
+        else:
+            # Задача будет выдана снова (этому или другому узлу), пока не исчерпан лимит max_claims
+            state = 'failed'
+        self.job_queue.finish(self._to_queue_dir(job['output_dir']), job['video_url'], state, job.get('error'))
+
+    def on_batch_committed(self, committed):
+        for job in committed:
+            self.held -= 1
+            self.job_queue.finish(self._to_queue_dir(job['output_dir']), job['video_url'], 'done')
+        committed.clear()
+
+    def is_finished(self):
+        if self.held or not self.queue_empty:
+            return False
+        # Свободных задач нет; ждем, пока другие узлы не завершат (или не потеряют) свои аренды
+        now = time.monotonic()
+        if now - self.polled_at < self.poll_interval:
+            return False
+        counts = self.job_queue.counts()
+        # Упавшие задачи с оставшимися выдачами заберет следующий опрос; исчерпавшие лимит он же переведет в dead
+        if counts.get('pending') or counts.get('leased') or counts.get('failed'):
+            self.queue_empty = False
+            return False
+        return True
+
+    def get_dead_letters(self):
+        return [
+            {'video_url': video_url, 'output_dir': self._from_queue_dir(queue_dir), 'attempt': attempts, 'error': error}
+            for queue_dir, video_url, attempts, error in self.job_queue.dead_tasks()
+        ]
@@ -1,14 +1,34 @@
 import os
+import re
+import json
+import time
 import signal
+import uuid
 import logging
+import importlib
 import multiprocessing
-from multiprocessing import Pool
-from tqdm import tqdm
-from .url_utils import get_video_id, get_playlist_id, read_video_urls, get_rutube_playlist_video_ids
-from .logging_utils import setup_logging, filter_yt_dlp_output
-from .file_utils import create_file_index, find_existing_file
+from multiprocessing.util import Finalize
+from .url_utils import get_video_id, get_playlist_id, read_video_urls
+from .enumeration import enumerate_playlist
+from .logging_utils import setup_logging, filter_yt_dlp_output, classify_yt_dlp_line, get_component_logger, start_log_listener, stop_log_listener, set_log_queue
+from .file_utils import get_file_index, update_file_index, find_existing_file, get_staging_dir, get_scratch_dir, verify_media_file, commit_staged_file, discard_staged_files
 from .subprocess_utils import subprocess_run_context
-from .metadata_utils import update_metadata_to_csv, process_video_metadata, cleanup_info_json_files, get_file_metadata
+from .metadata_utils import process_video_metadata, cleanup_info_json_files, get_file_metadata
+from .metadata_store import upsert_metadata_batch, export_metadata_to_csv, load_manifest, record_manifest_batch, is_manifest_satisfied, load_stored_metadata, load_postprocess_records, record_postprocess_batch
+from .ytdlp_engine import build_format_string, download_with_engine, extract_video_info, get_youtube_dl, close_engine, DownloadCancelled
+from .scheduler import DownloadScheduler
+from .rate_limit import create_rate_limiters, set_rate_limiters, acquire_rate_limit, penalize_rate_limit
+from .metrics import record_timing, timed_stage, RunMetrics
+from .progress import set_progress_queue, create_progress_queue, is_progress_due, report_progress, report_progress_done, ByteProgress
+from .job_queue import open_job_queue, get_node_id
+from .content_store import is_dedup_enabled, find_store_file, link_from_store, commit_to_store, adopt_into_store, get_store_info, store_lock
+from .distributed import DistributedFeed
+from .watch import WatchFeed
+from .probe_cache import create_probe_cache_counters, set_probe_cache_counters, get_probe_cache_stats, is_probe_cache_enabled
+from .postprocess import is_postprocess_enabled, get_task_params, is_record_current, serialize_params, run_postprocess_task, PostprocessCancelled
+from .fragment_budget import create_fragment_budget, set_fragment_budget, get_fragment_concurrency, fragment_slot
+from .admission import create_disk_admission
+from .format_plan import is_format_plan_enabled, read_format_cache, write_format_cache, plan_height, format_plan_row, estimate_download_size
 
 # Глобальная переменная для отслеживания состояния прерывания
 interrupt_event = multiprocessing.Event()
@@ -17,182 +37,645 @@ def signal_handler(signum, frame):
     logging.info("Получен сигнал прерывания. Начинаем корректное завершение...")
     interrupt_event.set()
 
-def init_worker():
+def init_worker(shared_state, preload=None):
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-
-def download_video(args):
-    video_url, output_dir, video_quality, file_index, config = args
+    set_log_queue(shared_state['log_queue'], shared_state['config'])
+    if shared_state['progress_queue'] is not None:
+        set_progress_queue(shared_state['progress_queue'], shared_state['config'].get('progress', {}).get('report_interval', 0.5))
+    set_probe_cache_counters(*shared_state['probe_cache_counters'])
+    set_rate_limiters(shared_state['rate_limiters'])
+    set_fragment_budget(shared_state['fragment_budget'])
+    # Прогретые экземпляры YoutubeDL закрываются при штатном завершении воркера (pool.close/join)
+    Finalize(None, close_engine, exitpriority=10)
+    if preload is not None:
+        # Тяжелые модули стадии импортируются один раз при запуске воркера, а не в первой задаче
+        preload(shared_state['config'])
+
+def preload_download_worker(config):
+    if config.get('download_engine', 'inprocess') == 'inprocess':
+        get_youtube_dl(build_format_string(config.get('video_quality')))
+
+def preload_probe_worker(config):
+    importlib.import_module('ffprobe')
+
+# Ошибки, после которых повторная попытка не имеет смысла, и признаки ограничения частоты запросов
+PERMANENT_ERROR_PATTERN = re.compile(r'Video unavailable|Private video|has been removed|members-only|copyright|not available in your country|Unsupported URL', re.IGNORECASE)
+THROTTLE_ERROR_PATTERN = re.compile(r'HTTP Error (?:429|403)|Too Many Requests', re.IGNORECASE)
+
+# Поля info dict, которые передаются между стадиями (полный словарь слишком тяжел для передачи между процессами)
+INFO_FIELDS = ('id', 'title')
+
+def trim_info(info):
+    return {key: info.get(key) for key in INFO_FIELDS} if info else None
+
+def get_commit_route(config):
+    # Перед фиксацией видео проходит стадию постобработки, если она включена
+    return 'postprocess' if is_postprocess_enabled(config) else 'commit'
+
+def probe_video(job):
+    config = job['config']
     logger = setup_logging(config, worker=True)
 
     if interrupt_event.is_set():
-        return False, None
-
-    platform, video_id = get_video_id(video_url)
-
-    if not video_id:
-        logger.warning(f"Некорректный URL видео: {video_url}")
-        return False, None
-
-    logger.info(f"Обработка видео с ID: {video_id} на платформе {platform}")
-
-    existing_file_path = find_existing_file(output_dir, video_id, file_index)
-
-    if existing_file_path:
-        existing_height = get_file_metadata(existing_file_path, config).get('height')
-
-        if video_quality and existing_height is not None:
-            target_height = int(video_quality[:-1])
-            existing_height = int(existing_height)
-            if existing_height == target_height:
-                logger.info(f"Файл {video_id} с требуемым разрешением уже существует. Обновляем метаданные.")
-                metadata = process_video_metadata(video_url, existing_file_path, output_dir, config)
-                return True, metadata
-            else:
-                logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p. Будет загружен файл с разрешением {target_height}p.")
+        job.update(next='done', success=False)
+        return job
+
+    video_id = job['video_id']
+    video_quality = job['video_quality']
+
+    if job['action'] == 'check' and not verify_media_file(job['file_path']):
+        logger.warning(f"Существующий файл {job['file_path']} обрезан или поврежден. Будет выполнена повторная загрузка.")
+        job.update(action='download', next='download', store_rejected=bool(job.get('store_path')))
+        return job
+
+    # Ссылки на файл хранилища анализируются по пути в хранилище, чтобы кэш ffprobe был общим для всех плейлистов
+    with timed_stage(job, 'probe'):
+        file_metadata = get_file_metadata(job.get('store_path') or job['file_path'], config)
+    job['file_metadata'] = file_metadata
+
+    if job['action'] != 'check':
+        job['next'] = get_commit_route(config)
+        return job
+
+    # Проверка уже существующего файла: нужна ли повторная загрузка
+    existing_height = file_metadata.get('height')
+    if existing_height not in (None, 'N/A'):
+        existing_height = int(existing_height)
+        if video_quality and existing_height == int(video_quality[:-1]):
+            logger.info(f"Файл {video_id} с требуемым разрешением уже существует. Обновляем метаданные.")
+            return keep_existing_file(job)
+        if is_format_plan_enabled(config):
+            heights = read_format_cache(job['platform'], video_id, config)
+            if heights is None:
+                # Доступные форматы еще неизвестны: их запросит стадия загрузки перед решением о загрузке
+                job.update(action='plan', next='download')
+                return job
+            planned_height = plan_height(heights, video_quality)
+            if planned_height in (None, existing_height):
+                logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p - лучшее доступное для запрошенного качества. Обновляем метаданные.")
+                return keep_existing_file(job)
+            logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p. Будет загружен файл с разрешением {planned_height}p.")
+        elif video_quality:
+            logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p. Будет загружен файл с разрешением {video_quality}.")
+
+    job.update(action='download', next='download', file_metadata=None, store_rejected=bool(job.get('store_path')))
+    return job
+
+def keep_existing_file(job):
+    # Существующий файл остается; для метаданных нужна только информация о видео
+    config = job['config']
+    video_id = job['video_id']
+    store_info = get_store_info(config, job['platform'], video_id) if job.get('store_path') else None
+    if store_info is None and job.get('store_path'):
+        stored_metadata = job.get('stored_metadata')
+        store_info = {'id': video_id, 'title': stored_metadata['title']} if stored_metadata and stored_metadata.get('title') else None
+    if store_info:
+        # Информация о видео из хранилища уже известна: повторно она не запрашивается
+        job.update(info=store_info, next=get_commit_route(config))
+        return job
+    job.update(action='info', next='download')
+    return job
+
+def plan_download(job, logger):
+    # Запрос доступных форматов: если лучшее достижимое разрешение уже есть, загрузка не нужна.
+    # Возвращает True, если видео нужно загрузить
+    video_id = job['video_id']
+    if not acquire_rate_limit(job['platform'], interrupt_event):
+        return False
+    try:
+        with timed_stage(job, 'extract_info'):
+            info = extract_video_info(job['video_url'])
+    except Exception as e:
+        logger.error(f"Ошибка при получении форматов видео {video_id}: {e}")
+        schedule_retry(job, e, 'download', logger)
+        return False
+
+    heights = write_format_cache(job['platform'], video_id, info, job['config'])
+    planned_height = plan_height(heights, job['video_quality'])
+    existing_height = int(job['file_metadata']['height'])
+    if heights and planned_height in (None, existing_height):
+        logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p - лучшее доступное для запрошенного качества. Обновляем метаданные.")
+        job.update(info=trim_info(info), next=get_commit_route(job['config']))
+        return False
+    if heights:
+        logger.info(f"Существующий файл {video_id} имеет разрешение {existing_height}p. Будет загружен файл с разрешением {planned_height}p.")
     else:
-        logger.info(f"Видеозаписи с ID: {video_id} не существует. Начинаем загрузку.")
+        logger.info(f"Список форматов видео {video_id} недоступен. Будет выполнена повторная загрузка.")
+    job.update(action='download', file_metadata=None, store_rejected=bool(job.get('store_path')))
+    return True
+
+def download_video(job):
+    video_url = job['video_url']
+    output_dir = job['output_dir']
+    video_id = job['video_id']
+    platform = job['platform']
+    config = job['config']
+    logger = setup_logging(config, worker=True)
+
+    job.update(next='done', success=False)
+    if interrupt_event.is_set():
+        return job
+
+    if job['action'] == 'plan':
+        # Планирование допускается без резерва места; решенная загрузка возвращается в очередь стадии,
+        # чтобы пройти допуск по свободному месту как обычная загрузка
+        if plan_download(job, logger):
+            job['next'] = 'download'
+        return job
+
+    if job['action'] == 'download' and is_dedup_enabled(config):
+        # Видео из нескольких плейлистов загружает один воркер; остальные откладываются и затем берут файл из хранилища
+        with store_lock(config, platform, video_id) as locked:
+            if not locked:
+                logger.debug(f"Видео {video_id} уже загружается другим воркером, задача отложена")
+                job.update(next='wait', retry_stage='download', wait_delay=config.get('dedup', {}).get('lock_wait', 2))
+                return job
+            store_path = None if job.get('store_rejected') else find_store_file(config, platform, video_id, logger, use_index=False)
+            if store_path:
+                logger.info(f"Видео {video_id} уже есть в общем хранилище: {store_path}")
+                job.update(file_path=link_from_store(store_path, output_dir, logger), store_path=store_path, action='check', next='probe')
+                return job
+            return fetch_video(job, logger)
+    return fetch_video(job, logger)
+
+def fetch_video(job, logger):
+    video_url = job['video_url']
+    output_dir = job['output_dir']
+    video_id = job['video_id']
+    platform = job['platform']
+    config = job['config']
+
+    # Запросы к платформе проходят через общий для всех воркеров ограничитель частоты
+    if not acquire_rate_limit(platform, interrupt_event):
+        return job
+
+    if job['action'] == 'info':
+        # Файл уже в нужном качестве: требуется только информация о видео
+        try:
+            with timed_stage(job, 'extract_info'):
+                info = extract_video_info(video_url)
+            job.update(info=trim_info(info), next=get_commit_route(config))
+        except Exception as e:
+            logger.error(f"Ошибка при получении информации о видео {video_id}: {e}")
+            schedule_retry(job, e, 'download', logger)
+        return job
 
-    format_string = f"bestvideo[height<={video_quality[:-1]}]+bestaudio/best[height<={video_quality[:-1]}]" if video_quality else "bestvideo+bestaudio/best"
-    output_template = os.path.join(output_dir, f"{video_id}.%(ext)s")
+    format_string = build_format_string(job['video_quality'])
+    # Загрузка и слияние форматов идут в область staging (на быстром диске scratch_dir, если он задан);
+    # в output_dir попадает только проверенный файл
+    staging_dir = get_staging_dir(output_dir, config.get('distributed', {}).get('node_id'), get_scratch_dir(config))
+    output_template = os.path.join(staging_dir, f"{video_id}.%(ext)s")
 
     logger.info(f"Начало загрузки видео {video_id} с {platform}")
-    download_command = [
-        "yt-dlp",
-        video_url,
-        "-f", format_string,
-        "--output", output_template,
-        "--force-overwrites",
-        "--no-continue",
-        "--no-part",
-        "--merge-output-format", "mp4",
-        "--no-warnings"
-    ]
 
     try:
-        with subprocess_run_context(download_command) as process:
-            while True:
-                if interrupt_event.is_set():
-                    process.terminate()
-                    logger.info(f"Загрузка видео {video_id} прервана.")
-                    return False, None
-
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    filtered_output = filter_yt_dlp_output(output.strip())
-                    if filtered_output:
-                        logger.debug(filtered_output)
-
-            stderr = process.stderr.read()
-            if stderr:
-                filtered_stderr = filter_yt_dlp_output(stderr)
-                if filtered_stderr:
-                    logger.error(f"yt-dlp stderr для видео {video_id}:\n{filtered_stderr}")
+        # Загрузка занимает место в общем бюджете соединений для фрагментов
+        with fragment_slot():
+            if config.get('download_engine', 'inprocess') == 'inprocess':
+                timings = {}
+                try:
+                    new_file_path, info = download_with_engine(video_url, output_template, format_string, interrupt_event, logger, timings)
+                finally:
+                    # Если движок упал до начала extract_info, замеров нет и исходная ошибка не должна подменяться KeyError
+                    if timings:
+                        record_timing(job, 'extract_info', timings['extract_info'])
+                        record_timing(job, 'download', timings['download'], timings['bytes'])
+                        if timings['merge']:
+                            record_timing(job, 'merge', timings['merge'])
+            else:
+                start = time.perf_counter()
+                new_file_path, info = download_with_subprocess(video_url, output_template, format_string, video_id, logger)
+                record_timing(job, 'download', time.perf_counter() - start, os.path.getsize(new_file_path) if new_file_path else 0)
 
         if interrupt_event.is_set():
-            return False, None
-
-        new_file_path = find_existing_file(output_dir, video_id, create_file_index(output_dir, logger))
-        if new_file_path:
+            logger.info(f"Загрузка видео {video_id} прервана.")
+            return job
+
+        if new_file_path and not verify_media_file(new_file_path):
+            # Поврежденный файл нельзя докачать: он удаляется, а загрузка повторяется заново
+            discard_staged_files(staging_dir, video_id)
+            logger.error(f"Файл {new_file_path} не прошел проверку контейнера и удален.")
+            schedule_retry(job, RuntimeError(f"Файл видео {video_id} не прошел проверку контейнера"), 'download', logger)
+        elif new_file_path:
+            if info and is_format_plan_enabled(config):
+                # Список форматов из загрузки сохраняется для планирования следующих запусков
+                write_format_cache(platform, video_id, info, config)
+            if is_dedup_enabled(config):
+                # Проверенный файл попадает в общее хранилище, а в папку плейлиста - ссылка на него
+                store_path = commit_to_store(new_file_path, config, platform, video_id, trim_info(info))
+                new_file_path = link_from_store(store_path, output_dir, logger)
+                job['store_path'] = store_path
+            else:
+                new_file_path = commit_staged_file(new_file_path, output_dir, video_id)
             new_size = os.path.getsize(new_file_path)
             new_size_mb = new_size / (1024 * 1024)
             logger.info(f"Загрузка видео {video_id} завершена. Размер файла: {new_size_mb:.2f} MB")
 
-            # Обработка метаданных
-            metadata = process_video_metadata(video_url, new_file_path, output_dir, config)
-
-            return True, metadata
+            # info dict из загрузки передается на стадию метаданных, без повторного извлечения
+            if info is None:
+                with timed_stage(job, 'extract_info'):
+                    info = extract_video_info(video_url)
+            job.update(file_path=new_file_path, info=trim_info(info), action='probe', next='probe')
+            report_progress_done(video_id, True, new_size)
         else:
             logger.error(f"Ошибка: Файл не найден после попытки загрузки видео {video_id}")
+    except DownloadCancelled:
+        logger.info(f"Загрузка видео {video_id} прервана.")
     except Exception as e:
         logger.error(f"Ошибка во время загрузки видео {video_id}: {e}")
-        return False, None
-
-    return False, None
-
-def download_playlist(playlist_url: str, output_dir: str, num_workers: int, video_quality: str, config, logger):
-
-    platform, playlist_id = get_playlist_id(playlist_url)
-
-    if not playlist_id:
-        logger.error(f"Некорректный URL плейлиста: {playlist_url}")
-        return
-
-    if platform == 'youtube':
-
-        list_command = [
-            "yt-dlp",
-            "--flat-playlist",
-            "--get-id",
-            playlist_url
-        ]
+        schedule_retry(job, e, 'download', logger)
+    finally:
+        if job['next'] != 'probe':
+            report_progress_done(video_id, False)
+
+    return job
+
+def schedule_retry(job, error, stage, logger):
+    message = str(error)
+    if PERMANENT_ERROR_PATTERN.search(message):
+        # Повторять бессмысленно: видео недоступно, сразу в список незагруженных
+        job.update(next='dead', error=message)
+        return job
+    if THROTTLE_ERROR_PATTERN.search(message):
+        pause = job['config'].get('retry', {}).get('throttle_pause', 30)
+        logger.warning(f"Платформа {job['platform']} ограничивает запросы. Пауза {pause} с для всех воркеров.")
+        penalize_rate_limit(job['platform'], pause)
+    job.update(next='retry', retry_stage=stage, error=message)
+    return job
+
+def postprocess_video(job):
+    config = job['config']
+    video_id = job['video_id']
+    logger = setup_logging(config, worker=True)
 
+    job['next'] = 'commit'
+    if interrupt_event.is_set():
+        job.update(next='done', success=False)
+        return job
+
+    file_path = job['file_path']
+    source_size = os.path.getsize(file_path)
+    records = job.get('postprocess_records') or {}
+    outputs = []
+    for task, params in get_task_params(config).items():
+        record = records.get(task)
+        if is_record_current(record, params, source_size) and os.path.exists(os.path.join(job['output_dir'], record['output'])):
+            continue
         try:
-            with subprocess_run_context(list_command) as process:
-                stdout, stderr = process.communicate()
-            video_ids = stdout.strip().split('\n')
+            with timed_stage(job, f'postprocess_{task}'):
+                output = run_postprocess_task(task, file_path, job['output_dir'], video_id, params, interrupt_event)
+        except PostprocessCancelled:
+            break
         except Exception as e:
-            logger.error(f"Ошибка при обработке плейлиста {playlist_url}: {e}")
-            return
-
-        video_urls = [f"https://www.youtube.com/watch?v={vid}" for vid in video_ids]
+            logger.error(f"Ошибка постобработки {task} для видео {video_id}: {e}")
+            continue
+        logger.info(f"Постобработка {task} для видео {video_id} завершена: {output}")
+        outputs.append({'task': task, 'params': serialize_params(params), 'source_size': source_size, 'output': output})
+    job['postprocess'] = outputs
+    return job
+
+def commit_video(job, postprocess_outputs):
+    # Результаты постобработки копятся по источнику и записываются в базу одной транзакцией в finalize_output_dir
+    if job.get('postprocess'):
+        postprocess_outputs.append((job['platform'], job['video_id'], job['postprocess']))
+    if job.get('metadata_current'):
+        # Видео пропущено по манифесту: фиксируются только результаты постобработки
+        return True, None
+    update_file_index(job['file_path'])
+    if is_dedup_enabled(job['config']) and not job.get('store_path'):
+        adopt_into_store(job['file_path'], job['config'], job['platform'], job['video_id'])
+    with timed_stage(job, 'metadata'):
+        metadata = process_video_metadata(
+            job['video_url'], job['file_path'], job['output_dir'], job['config'],
+            info=job['info'], file_metadata=job['file_metadata'], stored_metadata=job.get('stored_metadata')
+        )
+    return True, metadata
+
+def download_with_subprocess(video_url, output_template, format_string, video_id, logger):
+    # После переноса файла yt-dlp печатает итоговый путь и нужные поля info dict одной JSON строкой,
+    # поэтому директорию не нужно пересканировать, а видео - извлекать повторно
+    download_command = [
+        "yt-dlp",
+        video_url,
+        "-f", format_string,
+        "--output", output_template,
+        "--continue",
+        "--merge-output-format", "mp4",
+        "--no-warnings",
+        "--print", "after_move:%(.{id,title,filepath})j",
+        "--progress",
+        "--newline",
+        # Структурированный прогресс для общего побайтового индикатора
+        "--progress-template", "download:[progress] %(progress.{filename,downloaded_bytes,total_bytes,total_bytes_estimate})j"
+    ]
+    fragment_concurrency = get_fragment_concurrency()
+    if fragment_concurrency:
+        # Параллельная загрузка фрагментов видео, доля общего бюджета соединений
+        download_command += ["--concurrent-fragments", str(fragment_concurrency)]
+    info = None
+    # Строки прогресса форматируются, только если для компонента ytdlp включен уровень DEBUG
+    progress_logger = get_component_logger('ytdlp')
+    log_progress = progress_logger.isEnabledFor(logging.DEBUG)
+
+    with subprocess_run_context(download_command) as process:
+        while True:
+            if interrupt_event.is_set():
+                process.terminate()
+                return None, None
+
+            output = process.stdout.readline()
+            if output == '' and process.poll() is not None:
+                break
+            if output:
+                if output[0] == '{':
+                    info = json.loads(output)
+                    continue
+                if output.startswith('[progress] '):
+                    if is_progress_due():
+                        status = json.loads(output[11:])
+                        report_progress(video_id, status.get('filename'), status.get('downloaded_bytes'), status.get('total_bytes') or status.get('total_bytes_estimate'))
+                    continue
+                if log_progress:
+                    kind = classify_yt_dlp_line(output)
+                    if kind in ('progress', 'destination', 'error') and 'player=' not in output:
+                        progress_logger.debug(output.rstrip(), extra={'video_id': video_id})
+
+        stderr = process.stderr.read()
+        filtered_stderr = filter_yt_dlp_output(stderr) if stderr else ''
+        if filtered_stderr:
+            logger.error(f"yt-dlp stderr для видео {video_id}:\n{filtered_stderr}")
+        if process.returncode:
+            raise RuntimeError(filtered_stderr or f"yt-dlp завершился с кодом {process.returncode}")
+
+    file_path = info.get('filepath') if info else None
+    if not file_path or not os.path.exists(file_path):
+        file_path = None
+    return file_path, info
+
+def get_download_priority(job):
+    # Longest processing time first: большие загрузки раздаются раньше, и запуск не заканчивается
+    # одним воркером с длинным видео. Видео без оценки размера идут первыми в порядке плейлиста,
+    # а короткое получение информации о видео - последним
+    if job.get('action') == 'info':
+        return 0
+    return job.get('expected_size') or float('inf')
+
+def prepare_download_tasks(video_urls: list, output_dir: str, video_quality: str, config, logger, estimates=None):
+    # Индекс живет в родительском процессе; в задачу попадает только найденный путь, а не весь индекс.
+    # estimates - оценки длительности и размера видео из перечисления плейлиста {URL видео: оценка}
+    estimates = estimates or {}
+    file_index = get_file_index(output_dir, logger)
+    incremental = config.get('incremental_sync', False)
+    manifest = load_manifest(output_dir, config) if incremental else {}
+    dedup = is_dedup_enabled(config)
+    postprocess_tasks = get_task_params(config) if is_postprocess_enabled(config) else {}
+    postprocess_records = load_postprocess_records(output_dir, config) if postprocess_tasks else {}
+    skipped = 0
+    jobs = []
+    for video_url in video_urls:
+        platform, video_id = get_video_id(video_url)
+        job = {
+            'video_url': video_url,
+            'output_dir': output_dir,
+            'video_quality': video_quality,
+            'config': config,
+            'platform': platform,
+            'video_id': video_id,
+            'file_path': None,
+            'file_metadata': None,
+            'info': None,
+            'postprocess_records': postprocess_records.get((platform, video_id)),
+            'expected_duration': (estimates.get(video_url) or {}).get('duration'),
+            'expected_size': estimate_download_size(estimates.get(video_url), video_quality),
+        }
+        if not video_id:
+            logger.warning(f"Некорректный URL видео: {video_url}")
+            job.update(next='done', success=False)
+        elif incremental and is_manifest_satisfied(manifest.get((platform, video_id)), output_dir, video_quality):
+            entry = manifest[(platform, video_id)]
+            records = postprocess_records.get((platform, video_id)) or {}
+            if all(is_record_current(records.get(task), params, entry['file_size']) for task, params in postprocess_tasks.items()):
+                # Видео уже загружено в целевом качестве: без сетевых запросов и ffprobe
+                job.update(next='done', success=True)
+                skipped += 1
+            else:
+                # Загрузка не нужна, но результаты постобработки отсутствуют или получены с другими параметрами
+                job.update(file_path=os.path.join(output_dir, entry['file_name']), action='postprocess', next='postprocess', metadata_current=True)
+        else:
+            existing_file_path = find_existing_file(output_dir, video_id, file_index, verify=False)
+            store_path = find_store_file(config, platform, video_id, logger) if dedup and not existing_file_path else None
+            if store_path:
+                # Видео уже загружено для другого плейлиста: в папку плейлиста добавляется ссылка на файл хранилища
+                existing_file_path = link_from_store(store_path, output_dir, logger)
+                update_file_index(existing_file_path)
+                job['store_path'] = store_path
+                logger.info(f"Видео {video_id} взято из общего хранилища: {store_path}")
+            if existing_file_path:
+                # Существующий файл сначала проверяется на целостность и разрешение на стадии анализа
+                job.update(file_path=existing_file_path, action='check', next='probe')
+            else:
+                logger.info(f"Видеозаписи с ID: {video_id} не существует. Начинаем загрузку.")
+                job.update(action='download', next='download')
+        jobs.append(job)
+
+    # Сохраненные метаданные нужны при фиксации и для ссылок на хранилище; читаются один раз на пачку
+    active_jobs = [job for job in jobs if job['next'] in ('probe', 'download')]
+    stored_metadata = load_stored_metadata(((job['platform'], job['video_id']) for job in active_jobs), config)
+    for job in active_jobs:
+        job['stored_metadata'] = stored_metadata.get((job['platform'], job['video_id']))
+
+    if incremental:
+        logger.info(f"Инкрементальная синхронизация {output_dir}: пропущено {skipped} из {len(video_urls)} видео по манифесту.")
+    return jobs
+
+def finalize_output_dir(results: list, output_dir: str, video_quality: str, config, logger, metrics, postprocess_outputs=None):
+    successful = sum(1 for success, _ in results if success)
+    logger.info(f"Успешно обработано {successful} из {len(results)} видео в {output_dir}.")
+
+    if postprocess_outputs:
+        with metrics.measure('commit'):
+            if not record_postprocess_batch(postprocess_outputs, output_dir, config):
+                logger.error("Не удалось сохранить результаты постобработки в базу.")
+        postprocess_outputs.clear()
+
+    # Сохраняем метаданные пачкой в базу и при необходимости выгружаем CSV
+    metadata_list = [metadata for _, metadata in results if metadata]
+    if metadata_list:
+        with metrics.measure('commit'):
+            commit_metadata(metadata_list, output_dir, video_quality, config, logger)
+
+    with metrics.measure('cleanup'):
+        cleanup_info_json_files(output_dir, config)
+
+def commit_metadata(metadata_list: list, output_dir: str, video_quality: str, config, logger):
+    if not upsert_metadata_batch(metadata_list, output_dir, config):
+        logger.error("Не удалось сохранить метаданные в базу.")
+    elif not record_manifest_batch(metadata_list, output_dir, video_quality, config):
+        logger.error("Не удалось обновить манифест загрузок.")
+    elif config.get('metadata', {}).get('export_csv', True):
+        csv_path = export_metadata_to_csv(output_dir, config)
+        if csv_path:
+            logger.info(f"Метаданные обновлены в файле: {csv_path}")
+        else:
+            logger.error("Не удалось обновить метаданные в файле CSV.")
 
-    elif platform == 'rutube':
-        try:
-            video_ids = get_rutube_playlist_video_ids(playlist_url, logger)
-            if not video_ids:
-                logger.error(f"Не удалось получить идентификаторы видео для плейлиста {playlist_url}")
-                return
-            video_urls = [f"https://rutube.ru/video/{vid}/" for vid in video_ids]
-        except Exception as e:
-            logger.error(f"Ошибка при обработке плейлиста {playlist_url}: {e}")
-            return
+def write_dead_letters(dead_letters, output_dir, logger, append=False):
+    # Видео, не загруженные после всех попыток, сохраняются в формате video_urls.txt для повторного запуска;
+    # append=True дописывает их к уже сохраненному списку (режим наблюдения)
+    failed_path = os.path.join(output_dir, 'failed_urls.txt')
+    if not dead_letters:
+        return None
+    if append:
+        with open(failed_path, 'a', encoding='utf-8') as f:
+            for job in dead_letters:
+                f.write(f"{job['video_url']}\n")
     else:
-        logger.error(f"Неподдерживаемая платформа: {platform}")
+        # Уникальный временный файл: в распределенном режиме список могут записывать несколько узлов
+        tmp_path = f"{failed_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in dead_letters:
+                f.write(f"{job['video_url']}\n")
+        os.replace(tmp_path, failed_path)
+    for job in dead_letters:
+        logger.error(f"Видео {job['video_url']} не загружено (попыток: {max(job.get('attempt', 0), 1)}): {job.get('error')}")
+    logger.info(f"Список незагруженных видео сохранен в файл: {failed_path}")
+    return failed_path
+
+def save_watch_state(scheduler, config, output_dir, logger, state):
+    # Режим наблюдения: состояние сохраняется периодически, а не только при остановке. Незагруженные видео
+    # дописываются в список и больше не хранятся в памяти, отчет перезаписывается последними замерами
+    if scheduler.dead_letters:
+        write_dead_letters(scheduler.dead_letters, output_dir, logger, append=state['dead_letters_written'])
+        state['dead_letters_written'] = True
+        scheduler.dead_letters.clear()
+    if config.get('metrics', {}).get('enabled', True):
+        return scheduler.metrics.write_report(config.get('metrics', {}).get('report_dir') or output_dir, 'run_report')
+    return None
+
+def add_download_source(scheduler, enumerate_fn, output_dir: str, video_quality: str, config, logger, feed=None):
+    # Оценки размеров из перечисления плейлиста нужны при подготовке задач для порядка загрузки
+    estimates = {}
+    if feed is not None:
+        # Распределенный режим: найденные видео публикуются в общую очередь вместе с оценками,
+        # а обрабатываются пачками, взятыми из нее
+        scheduler.add_source(output_dir, lambda: enumerate_fn(estimates), lambda video_urls: feed.publish(output_dir, video_urls, estimates), None, None)
         return
+    postprocess_outputs = []
+    scheduler.add_source(
+        output_dir,
+        lambda: enumerate_fn(estimates),
+        lambda video_urls: prepare_download_tasks(video_urls, output_dir, video_quality, config, logger, estimates),
+        lambda job: commit_video(job, postprocess_outputs),
+        lambda results: finalize_output_dir(results, output_dir, video_quality, config, logger, scheduler.metrics, postprocess_outputs)
+    )
+
+def add_download_batch(scheduler, output_dir: str, video_urls: list, video_quality: str, config, logger, done_fn=None, committed_fn=None, estimates=None):
+    # Пачка задач из общей очереди или из режима наблюдения; метаданные фиксируются по завершении
+    # каждой пачки, после чего задачи пачки отмечаются в очереди как выполненные
+    postprocess_outputs = []
+
+    def finalize(results):
+        finalize_output_dir(results, output_dir, video_quality, config, logger, scheduler.metrics, postprocess_outputs)
+        if committed_fn is not None:
+            committed_fn()
+
+    scheduler.add_batch(
+        output_dir,
+        video_urls,
+        lambda video_urls: prepare_download_tasks(video_urls, output_dir, video_quality, config, logger, estimates),
+        lambda job: commit_video(job, postprocess_outputs),
+        finalize,
+        done_fn
+    )
+
+def get_urls_file(config):
+    # Файл со списком плейлистов или отдельных видео, путь относительно папки проекта
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, config['playlists_file'] if config['use_playlists'] else config['video_urls_file'])
+
+def get_download_sources(config, logger):
+    # Пары (выходная директория, функция перечисления видео) для всех плейлистов или списка отдельных видео;
+    # функции перечисления принимают необязательный словарь для оценок размеров видео
+    output_dir = config['output_dir']
+    sources = []
+    if config['use_playlists']:
+        playlist_urls = read_video_urls(get_urls_file(config))
 
-    download_individual_videos(video_urls, output_dir, num_workers, video_quality, config, logger)
+        for playlist_url in playlist_urls:
+            platform, playlist_id = get_playlist_id(playlist_url)
+            if not playlist_id:
+                logger.warning(f"Некорректный URL плейлиста: {playlist_url}")
+                continue
 
-def download_individual_videos(video_urls: list, output_dir: str, num_workers: int, video_quality: str, config, logger):
-    file_index = create_file_index(output_dir, logger)
-    download_args = [(url, output_dir, video_quality, file_index, config) for url in video_urls]
+            playlist_dir = os.path.join(output_dir, playlist_id)
+            os.makedirs(playlist_dir, exist_ok=True)
 
-    metadata_list = []
-    with Pool(processes=num_workers, initializer=init_worker) as pool:
-        try:
-            results = []
-            for success, metadata in tqdm(pool.imap_unordered(download_video, download_args), total=len(video_urls), desc="Загрузка видео", ncols=70):
-                results.append(success)
-                if metadata:
-                    metadata_list.append(metadata)
-                if interrupt_event.is_set():
-                    logger.info("Прерывание загрузки...")
-                    pool.terminate()
-                    break
-        except KeyboardInterrupt:
-            logger.info("Получено прерывание клавиатуры. Завершаем работу пула процессов...")
-            pool.terminate()
-        finally:
-            pool.close()
-            pool.join()
-
-    successful = sum(1 for result in results if result)
-    logger.info(f"Успешно обработано {successful} из {len(results)} видео.")
-
-    # Обновляем метаданные в CSV файл
-    if metadata_list:
-        csv_path = None  # Инициализация переменной csv_path
-        for metadata in metadata_list:
-            csv_path = update_metadata_to_csv(metadata, output_dir, config)
-        if csv_path:
-            logger.info(f"Метаданные обновлены в файле: {csv_path}")
+            logger.info(f"Обработка плейлиста: {playlist_url}")
+            sources.append((playlist_dir, lambda estimates=None, url=playlist_url: enumerate_playlist(url, config, logger, estimates)))
+    else:
+        video_urls = read_video_urls(get_urls_file(config))
+        individual_videos_dir = os.path.join(output_dir, "individual_videos")
+        os.makedirs(individual_videos_dir, exist_ok=True)
+        logger.info(f"Создана папка для отдельных видео: {individual_videos_dir}")
+        sources.append((individual_videos_dir, lambda estimates=None: video_urls))
+    return sources
+
+def plan_output_dir(video_urls: list, output_dir: str, video_quality: str, config, logger):
+    # Те же решения, что принимают prepare_download_tasks и probe_video, но без загрузки,
+    # ссылок на хранилище и запросов к платформе: доступные форматы берутся только из кэша
+    file_index = get_file_index(output_dir, logger)
+    incremental = config.get('incremental_sync', False)
+    manifest = load_manifest(output_dir, config) if incremental else {}
+    dedup = is_dedup_enabled(config)
+    plan_formats = is_format_plan_enabled(config)
+    rows = []
+    for video_url in video_urls:
+        platform, video_id = get_video_id(video_url)
+        if not video_id:
+            continue
+        if incremental and is_manifest_satisfied(manifest.get((platform, video_id)), output_dir, video_quality):
+            rows.append((video_id, 'пропуск (манифест)', None, None))
+            continue
+        heights = read_format_cache(platform, video_id, config) if plan_formats else None
+        planned_height = plan_height(heights, video_quality)
+        file_path = find_existing_file(output_dir, video_id, file_index, verify=False)
+        if not file_path and dedup:
+            file_path = find_store_file(config, platform, video_id, logger)
+        existing_height = get_file_metadata(file_path, config).get('height') if file_path else None
+        if existing_height in (None, 'N/A'):
+            rows.append((video_id, 'загрузка', None, planned_height))
+            continue
+        existing_height = int(existing_height)
+        if video_quality and existing_height == int(video_quality[:-1]):
+            action = 'оставить'
+        elif heights is None and plan_formats:
+            action = 'проверка форматов'
+        elif heights and planned_height in (None, existing_height):
+            action = 'оставить (лучшее доступное)'
         else:
-            logger.error("Не удалось обновить метаданные в файле CSV.")
-
-    cleanup_info_json_files(output_dir, config)
+            action = 'повторная загрузка'
+        rows.append((video_id, action, existing_height, planned_height))
+    return rows
 
-def download_videos(config):
+def list_download_plan(config):
+    # Пробный запуск: план по каждому видео (действие, текущее и достижимое разрешение) без загрузки
+    logger = setup_logging(config)
+    video_quality = config.get('video_quality')
+    totals = {}
+    for output_dir, enumerate_fn in get_download_sources(config, logger):
+        rows = plan_output_dir(enumerate_fn(), output_dir, video_quality, config, logger)
+        print(f"\n{output_dir}: {len(rows)} видео, качество {video_quality or 'лучшее'}")
+        print(format_plan_row('id', 'действие', 'есть', 'будет'))
+        for video_id, action, existing_height, planned_height in rows:
+            print(format_plan_row(video_id, action, f"{existing_height}p" if existing_height else '-', f"{planned_height}p" if planned_height else '?'))
+            totals[action] = totals.get(action, 0) + 1
+    summary = ', '.join(f"{action}: {count}" for action, count in totals.items())
+    logger.info(f"План загрузки: {summary or 'видео не найдены'}")
+    return totals
+
+def download_videos(config, watch=False):
+    # watch=True - режим наблюдения: работа продолжается до SIGTERM/SIGINT, новые видео из файла
+    # со списком URL и из плейлистов добавляются в уже работающий планировщик
     logger = setup_logging(config)
 
     signal.signal(signal.SIGINT, signal_handler)
@@ -202,39 +685,98 @@ def download_videos(config):
     os.makedirs(output_dir, exist_ok=True)
     logger.info(f"Выходная директория: {output_dir}")
 
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
     video_quality = config.get('video_quality')
     if video_quality is None:
         logger.info("Качество видео не указано. Будет использовано лучшее доступное качество.")
     else:
         logger.info(f"Планируется загрузить видео в качестве: {video_quality}")
 
-    try:
-        if config['use_playlists']:
-            playlists_file = os.path.join(base_dir, config['playlists_file'])
-            playlist_urls = read_video_urls(playlists_file)
-
-            for playlist_url in playlist_urls:
-                if interrupt_event.is_set():
-                    break
-                platform, playlist_id = get_playlist_id(playlist_url)
-                if not playlist_id:
-                    logger.warning(f"Некорректный URL плейлиста: {playlist_url}")
-                    continue
-
-                playlist_dir = os.path.join(output_dir, playlist_id)
-                os.makedirs(playlist_dir, exist_ok=True)
+    feed = None
+    watcher = None
+    if watch and config.get('distributed', {}).get('enabled', False):
+        logger.error("Режим наблюдения не поддерживается в распределенном режиме.")
+        return
+    if config.get('distributed', {}).get('enabled', False):
+        # Идентификатор узла вычисляется один раз, чтобы воркеры и пульс аренды использовали одно значение
+        config = dict(config, distributed=dict(config['distributed'], node_id=get_node_id(config)))
+        logger.info(f"Распределенный режим, узел {config['distributed']['node_id']}")
 
-                logger.info(f"Обработка плейлиста: {playlist_url}")
-                download_playlist(playlist_url, playlist_dir, config['num_workers'], video_quality, config, logger)
+    try:
+        # Загрузка (сеть) и анализ файлов (ffprobe) выполняются разными пулами со своими лимитами
+        scheduler = DownloadScheduler(config, logger, interrupt_event)
+        if config.get('distributed', {}).get('enabled', False):
+            feed = DistributedFeed(
+                open_job_queue(config), config, logger, interrupt_event,
+                lambda batch_dir, video_urls, estimates, done_fn, committed_fn: add_download_batch(scheduler, batch_dir, video_urls, video_quality, config, logger, done_fn, committed_fn, estimates)
+            )
+            scheduler.feed = feed
+        # Общие для всех воркеров объекты передаются через инициализатор пула
+        shared_state = {
+            'config': config,
+            'log_queue': start_log_listener(config),
+            'progress_queue': create_progress_queue() if config.get('progress', {}).get('enabled', True) else None,
+            'probe_cache_counters': create_probe_cache_counters(),
+            'rate_limiters': create_rate_limiters(config),
+            'fragment_budget': create_fragment_budget(config),
+        }
+        set_probe_cache_counters(*shared_state['probe_cache_counters'])
+        set_rate_limiters(shared_state['rate_limiters'])
+        # Новые загрузки ждут в очереди, пока на томах недостаточно места для них
+        scheduler.admission = create_disk_admission(config, logger)
+        if shared_state['progress_queue'] is not None:
+            scheduler.byte_progress = ByteProgress(shared_state['progress_queue'], 'download', config.get('progress', {}).get('update_interval', 0.5))
+
+        download_priority = get_download_priority if config.get('download_order', 'lpt') == 'lpt' else None
+        scheduler.add_stage('download', download_video, config['num_workers'], initializer=init_worker, initargs=(shared_state, preload_download_worker), priority=download_priority)
+        scheduler.add_stage('probe', probe_video, config.get('probe_workers', 2), initializer=init_worker, initargs=(shared_state, preload_probe_worker))
+        if is_postprocess_enabled(config):
+            # Постобработка для датасета идет своим пулом параллельно с загрузкой следующих видео
+            scheduler.add_stage('postprocess', postprocess_video, config['postprocess'].get('workers', 2), initializer=init_worker, initargs=(shared_state,))
+
+        if watch:
+            # Плейлисты и отдельные видео приходят пачками из наблюдения за файлом и опросов плейлистов
+            watcher = WatchFeed(
+                config, logger, get_urls_file(config),
+                lambda batch_dir, video_urls, estimates: add_download_batch(scheduler, batch_dir, video_urls, video_quality, config, logger, estimates=estimates)
+            )
+            scheduler.feed = watcher
+            # Работа без остановки: в памяти остаются только незавершенные пачки и последние замеры
+            watch_config = config.get('watch', {})
+            watch_state = {'dead_letters_written': False}
+            scheduler.drop_finished_sources = True
+            scheduler.metrics = RunMetrics(watch_config.get('report_window', 10000))
+            scheduler.checkpoint = lambda: save_watch_state(scheduler, config, output_dir, logger, watch_state)
+            scheduler.checkpoint_interval = watch_config.get('report_interval', 300)
         else:
-            video_urls_file = os.path.join(base_dir, config['video_urls_file'])
-            video_urls = read_video_urls(video_urls_file)
-            individual_videos_dir = os.path.join(output_dir, "individual_videos")
-            os.makedirs(individual_videos_dir, exist_ok=True)
-            logger.info(f"Создана папка для отдельных видео: {individual_videos_dir}")
-            download_individual_videos(video_urls, individual_videos_dir, config['num_workers'], video_quality, config, logger)
+            for source_dir, enumerate_fn in get_download_sources(config, logger):
+                add_download_source(scheduler, enumerate_fn, source_dir, video_quality, config, logger, feed)
+
+        # Все плейлисты обрабатываются одним пулом процессов
+        if feed is not None:
+            feed.start()
+        if watcher is not None:
+            watcher.start()
+        scheduler.run()
+        logger.info(f"Всего успешно обработано {scheduler.succeeded} из {scheduler.completed} видео.")
+        if is_probe_cache_enabled(config):
+            hits, misses = get_probe_cache_stats()
+            logger.info(f"Кэш ffprobe: попаданий {hits}, промахов {misses}")
+        report_path = None
+        if watcher is not None:
+            logger.info(f"За время наблюдения в очередь поставлено {watcher.queued_total} видео")
+            report_path = save_watch_state(scheduler, config, output_dir, logger, watch_state)
+        else:
+            if feed is not None:
+                # Общий для всех узлов список незагруженных видео берется из очереди
+                logger.info(f"Узел обработал {feed.claimed_total} задач из общей очереди")
+                write_dead_letters(feed.get_dead_letters(), output_dir, logger)
+            else:
+                write_dead_letters(scheduler.dead_letters, output_dir, logger)
+            if config.get('metrics', {}).get('enabled', True):
+                report_name = f"run_report_{config['distributed']['node_id']}" if feed is not None else 'run_report'
+                report_path = scheduler.metrics.write_report(config.get('metrics', {}).get('report_dir') or output_dir, report_name)
+        if report_path:
+            logger.info(f"Отчет о запуске сохранен в файл: {report_path}")
 
         if interrupt_event.is_set():
             logger.info("Процесс загрузки прерван пользователем.")
@@ -243,4 +785,11 @@ def download_videos(config):
     except Exception as e:
         logger.error(f"Произошла ошибка во время выполнения: {e}")
     finally:
+        if feed is not None:
+            feed.stop(interrupted=interrupt_event.is_set())
+        if watcher is not None:
+            watcher.stop()
+        # Экземпляры YoutubeDL основного процесса (извлечение метаданных при фиксации)
+        close_engine()
         logger.info("Завершение работы...")
+        stop_log_listener()
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .url_utils import get_playlist_id, get_http_session, get_rutube_playlist_video_ids
+from .file_utils import get_cache_dir
+from .ytdlp_engine import extract_playlist_entries
+from .rate_limit import acquire_rate_limit
+
+RUTUBE_PLAYLIST_API = 'https://rutube.ru/api/playlist/custom/{playlist_id}/videos?page={page}&format=json'
+
+def _get_cache_path(platform, playlist_id, config):
+    cache_dir = os.path.join(get_cache_dir(config), 'playlists')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"{platform}_{playlist_id}.json")
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache(cache_path, video_ids, etag=None, estimates=None):
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'fetched_at': time.time(), 'etag': etag, 'video_ids': video_ids, 'estimates': estimates or {}}, f)
+    os.replace(tmp_path, cache_path)
+
+def _fetch_rutube_page(session, api_url, playlist_id, page, headers=None, speculative=False):
+    acquire_rate_limit('rutube')
+    response = session.get(api_url.format(playlist_id=playlist_id, page=page), headers=headers, timeout=30)
+    if response.status_code == 304:
+        return response, None
+    # Страницы окна запрашиваются наугад: 404 за последней страницей означает конец плейлиста
+    if speculative and response.status_code == 404:
+        return response, None
+    response.raise_for_status()
+    return response, response.json()
+
+def _page_entries(page_data):
+    return [result for result in page_data.get('results') or [] if result.get('id')]
+
+def get_entry_estimate(entry):
+    # Длительность и размер видео, которые плоское перечисление отдает без запроса к каждому видео
+    estimate = {
+        'duration': entry.get('duration'),
+        'filesize': entry.get('filesize') or entry.get('filesize_approx'),
+    }
+    return {key: value for key, value in estimate.items() if value}
+
+def fetch_rutube_playlist(playlist_id, config, logger, etag=None):
+    enumeration_config = config.get('enumeration', {})
+    api_url = enumeration_config.get('rutube_api_url') or RUTUBE_PLAYLIST_API
+    page_workers = enumeration_config.get('page_workers', 4)
+    session = get_http_session()
+
+    # Первая страница запрашивается условно: 304 означает, что плейлист не изменился
+    headers = {'If-None-Match': etag} if etag else None
+    response, first_page = _fetch_rutube_page(session, api_url, playlist_id, 1, headers)
+    if first_page is None:
+        return None, etag, None
+    new_etag = response.headers.get('ETag')
+
+    pages = {1: _page_entries(first_page)}
+    has_next = first_page.get('has_next')
+    num_pages = first_page.get('num_pages')
+
+    # Остальные страницы загружаются параллельно: все сразу, если известно их число, иначе окнами
+    with ThreadPoolExecutor(max_workers=page_workers) as executor:
+        next_page = 2
+        while has_next:
+            last_page = num_pages if num_pages else next_page + page_workers - 1
+            page_numbers = list(range(next_page, last_page + 1))
+            if not page_numbers:
+                break
+            results = executor.map(lambda page: _fetch_rutube_page(session, api_url, playlist_id, page, speculative=True)[1], page_numbers)
+            for page, page_data in zip(page_numbers, results):
+                # Конец списка - первая страница без видео, с 404 или с has_next = false;
+                # страницы окна после нее запрошены наугад, их ответы отбрасываются
+                page_entries = _page_entries(page_data or {})
+                if page_entries:
+                    pages[page] = page_entries
+                if not page_entries or not page_data.get('has_next'):
+                    has_next = False
+                    break
+            next_page = last_page + 1
+            if num_pages:
+                break
+
+    video_ids, estimates = _collect_entries(entry for page in sorted(pages) for entry in pages[page])
+    logger.info(f"Плейлист Rutube {playlist_id}: получено {len(video_ids)} видео с {len(pages)} страниц")
+    return video_ids, new_etag, estimates
+
+def _collect_entries(entries):
+    # Идентификаторы без повторов в порядке плейлиста и оценки {id: {'duration', 'filesize'}}
+    video_ids = []
+    estimates = {}
+    seen = set()
+    for entry in entries:
+        video_id = entry['id']
+        if video_id in seen:
+            continue
+        seen.add(video_id)
+        video_ids.append(video_id)
+        estimate = get_entry_estimate(entry)
+        if estimate:
+            estimates[video_id] = estimate
+    return video_ids, estimates
+
+def fetch_youtube_playlist(playlist_url, logger):
+    acquire_rate_limit('youtube')
+    entries = extract_playlist_entries(playlist_url)
+    video_ids, estimates = _collect_entries(entry for entry in entries if entry.get('id'))
+    logger.info(f"Плейлист YouTube {playlist_url}: получено {len(video_ids)} видео")
+    return video_ids, estimates
+
+def build_video_urls(platform, video_ids):
+    if platform == 'youtube':
+        return [f"https://www.youtube.com/watch?v={vid}" for vid in video_ids]
+    return [f"https://rutube.ru/video/{vid}/" for vid in video_ids]
+
+def enumerate_playlist(playlist_url, config, logger, estimates=None):
+    # Если передан словарь estimates, в него записываются оценки длительности и размера {URL видео: оценка}
+    platform, playlist_id = get_playlist_id(playlist_url)
+
+    if not playlist_id:
+        logger.error(f"Некорректный URL плейлиста: {playlist_url}")
+        return []
+    if platform not in ('youtube', 'rutube'):
+        logger.error(f"Неподдерживаемая платформа: {platform}")
+        return []
+
+    ttl = config.get('enumeration', {}).get('cache_ttl', 3600)
+    cache_path = _get_cache_path(platform, playlist_id, config)
+    cached = _read_cache(cache_path)
+    if cached and time.time() - cached['fetched_at'] < ttl:
+        logger.info(f"Список видео плейлиста {playlist_url} взят из кэша")
+        video_ids, video_estimates = cached['video_ids'], cached.get('estimates') or {}
+    else:
+        video_estimates = {}
+        try:
+            if platform == 'youtube':
+                (video_ids, video_estimates), etag = fetch_youtube_playlist(playlist_url, logger), None
+            else:
+                video_ids, etag, video_estimates = fetch_rutube_playlist(playlist_id, config, logger, etag=cached and cached.get('etag'))
+                if video_ids is None:
+                    logger.info(f"Плейлист {playlist_url} не изменился с прошлого запроса")
+                    video_ids, video_estimates = cached['video_ids'], cached.get('estimates') or {}
+        except Exception as e:
+            logger.error(f"Ошибка при обработке плейлиста {playlist_url}: {e}")
+            video_ids, etag = [], None
+            if platform == 'rutube':
+                # Запасной вариант: разбор HTML страницы плейлиста
+                video_ids = get_rutube_playlist_video_ids(playlist_url, logger)
+
+        if not video_ids and cached:
+            logger.warning(f"Используется устаревший список видео плейлиста {playlist_url} из кэша")
+            video_ids, video_estimates = cached['video_ids'], cached.get('estimates') or {}
+        elif not video_ids:
+            logger.error(f"Не удалось получить идентификаторы видео для плейлиста {playlist_url}")
+            return []
+        else:
+            _write_cache(cache_path, video_ids, etag, video_estimates)
+
+    video_urls = build_video_urls(platform, video_ids)
+    if estimates is not None:
+        estimates.update((video_url, video_estimates[video_id]) for video_id, video_url in zip(video_ids, video_urls) if video_id in video_estimates)
+    return video_urls
@@ -1,14 +1,124 @@
 import os
+import errno
+import shutil
+import struct
+import uuid
+
+# Индексы файлов выходных директорий, построенные в этом процессе: {директория: {id: имя файла}}
+_file_indexes = {}
 
 def create_file_index(directory, logger):
-    file_index = {os.path.splitext(f)[0]: f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))}
+    # os.scandir берет тип файла из записи каталога, без отдельного stat на каждый файл
+    with os.scandir(directory) as entries:
+        file_index = {os.path.splitext(entry.name)[0]: entry.name for entry in entries if entry.is_file()}
     logger.debug(f"Создан индекс файлов для директории {directory}")
     return file_index
 
-def find_existing_file(output_dir, video_id, file_index):
+def get_file_index(directory, logger):
+    # Индекс строится один раз на директорию, дальше только обновляется
+    key = os.path.abspath(directory)
+    file_index = _file_indexes.get(key)
+    if file_index is None:
+        file_index = _file_indexes[key] = create_file_index(directory, logger)
+    return file_index
+
+def update_file_index(file_path):
+    directory, file_name = os.path.split(os.path.abspath(file_path))
+    file_index = _file_indexes.get(directory)
+    if file_index is not None:
+        file_index[os.path.splitext(file_name)[0]] = file_name
+
+def find_existing_file(output_dir, video_id, file_index, verify=True):
     file_name = file_index.get(video_id)
     if file_name:
         full_path = os.path.join(output_dir, file_name)
-        if os.path.exists(full_path):
+        if os.path.exists(full_path) and (not verify or verify_media_file(full_path)):
             return full_path
     return None
+
+def get_scratch_dir(config):
+    return config.get('storage', {}).get('scratch_dir') or None
+
+def get_staging_dir(output_dir, node_id=None, scratch_dir=None):
+    # Незавершенные загрузки (.part и промежуточные форматы) хранятся отдельно от готовых файлов;
+    # в распределенном режиме у каждого узла своя область, чтобы узлы не докачивали чужие .part файлы.
+    # На быстром диске scratch_dir у каждой выходной директории своя папка: одно видео может загружаться
+    # для нескольких плейлистов одновременно
+    if scratch_dir:
+        staging_dir = os.path.join(scratch_dir, os.path.basename(os.path.normpath(output_dir)))
+    else:
+        staging_dir = os.path.join(output_dir, '.partial')
+    if node_id:
+        staging_dir = os.path.join(staging_dir, node_id)
+    os.makedirs(staging_dir, exist_ok=True)
+    return staging_dir
+
+def move_file(source_path, target_path):
+    # В пределах тома - атомарное переименование. Между томами (scratch_dir на другом диске) файл
+    # копируется одним последовательным проходом во временный файл рядом с целевым и затем переименовывается
+    try:
+        os.replace(source_path, target_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    os.remove(source_path)
+
+def verify_media_file(file_path):
+    # Размер из info dict yt-dlp приблизительный, поэтому проверяется только целостность контейнера
+    try:
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            return False
+        if os.path.splitext(file_path)[1].lower() not in ('.mp4', '.m4a', '.mov'):
+            return True
+
+        # Проходим по боксам верхнего уровня: у обрезанного файла последний бокс выходит за конец файла
+        box_types = set()
+        with open(file_path, 'rb') as f:
+            offset = 0
+            while offset < file_size:
+                f.seek(offset)
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                box_size, box_type = struct.unpack('>I4s', header)
+                if box_size == 1:
+                    box_size = struct.unpack('>Q', f.read(8))[0]
+                elif box_size == 0:
+                    box_size = file_size - offset
+                if box_size < 8:
+                    return False
+                box_types.add(box_type)
+                offset += box_size
+        return offset == file_size and b'ftyp' in box_types and b'moov' in box_types
+    except OSError:
+        return False
+
+def commit_staged_file(staged_path, output_dir, video_id):
+    # Атомарный перенос проверенного файла из области загрузки в выходную директорию
+    final_path = os.path.join(output_dir, os.path.basename(staged_path))
+    move_file(staged_path, final_path)
+    discard_staged_files(os.path.dirname(staged_path), video_id)
+    return final_path
+
+def discard_staged_files(staging_dir, video_id):
+    # Удаляем остатки загрузки видео: части фрагментов, отдельные дорожки и непрошедший проверку файл
+    for file_name in os.listdir(staging_dir):
+        if file_name.startswith(f"{video_id}."):
+            try:
+                os.remove(os.path.join(staging_dir, file_name))
+            except OSError:
+                pass
+
+def get_cache_dir(config):
+    cache_dir = config.get('cache_dir') or os.path.join(config['output_dir'], '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
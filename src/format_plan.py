@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import uuid
+from .file_utils import get_cache_dir
+
+# Планирование качества: по списку доступных форматов видео определяется разрешение, которое
+# на самом деле даст строка формата для video_quality. Если лучшее доступное разрешение ниже
+# запрошенного (просим 720p, есть только 480p), уже загруженный файл 480p повторно не скачивается.
+# Доступные разрешения кэшируются на диске: <cache_dir>/formats/<платформа>_<id>.json
+
+def is_format_plan_enabled(config):
+    return config.get('format_plan', {}).get('enabled', True)
+
+def _get_cache_path(platform, video_id, config):
+    cache_dir = os.path.join(get_cache_dir(config), 'formats')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"{platform}_{video_id}.json")
+
+def get_available_heights(info):
+    # Разрешения всех форматов с видеодорожкой (только аудио не учитываются)
+    heights = {f['height'] for f in info.get('formats') or [] if f.get('height') and f.get('vcodec') != 'none'}
+    if not heights and info.get('height'):
+        heights.add(info['height'])
+    return sorted(heights)
+
+def plan_height(heights, video_quality):
+    # Повторяет выбор строки формата bestvideo[height<=H]+bestaudio/best[height<=H]
+    if not heights:
+        return None
+    if not video_quality:
+        return max(heights)
+    target_height = int(video_quality[:-1])
+    suitable = [height for height in heights if height <= target_height]
+    return max(suitable) if suitable else None
+
+# Примерный суммарный поток (видео и аудио) в байтах в секунду по разрешению: оценка размера видео по длительности
+QUALITY_BYTE_RATES = {144: 15000, 240: 35000, 360: 70000, 480: 130000, 720: 300000, 1080: 600000, 1440: 1200000, 2160: 2500000}
+
+def estimate_download_size(estimate, video_quality):
+    # Размер из перечисления плейлиста, если он известен, иначе длительность, умноженная на поток для video_quality
+    if not estimate:
+        return None
+    if estimate.get('filesize'):
+        return int(estimate['filesize'])
+    if not estimate.get('duration'):
+        return None
+    target_height = int(video_quality[:-1]) if video_quality else max(QUALITY_BYTE_RATES)
+    byte_rate = next((rate for height, rate in sorted(QUALITY_BYTE_RATES.items()) if height >= target_height), QUALITY_BYTE_RATES[max(QUALITY_BYTE_RATES)])
+    return int(estimate['duration'] * byte_rate)
+
+def read_format_cache(platform, video_id, config):
+    ttl = config.get('format_plan', {}).get('cache_ttl', 604800)
+    try:
+        with open(_get_cache_path(platform, video_id, config), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached['fetched_at'] >= ttl:
+        return None
+    return cached['heights']
+
+def write_format_cache(platform, video_id, info, config):
+    heights = get_available_heights(info)
+    if not heights:
+        return heights
+    cache_path = _get_cache_path(platform, video_id, config)
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'fetched_at': time.time(), 'heights': heights}, f)
+    os.replace(tmp_path, cache_path)
+    return heights
+
+def format_plan_row(video_id, action, existing, planned):
+    # Строка таблицы пробного запуска: id, текущее разрешение, достижимое разрешение, действие
+    return f"{video_id:<36} {existing:>6} {planned:>6}  {action}"
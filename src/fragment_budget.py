@@ -0,0 +1,75 @@
+import multiprocessing
+from contextlib import contextmanager
+
+# Общий на все воркеры бюджет соединений для параллельной загрузки фрагментов (HLS/DASH) одного видео.
+# Загрузка при старте получает долю из еще не выданных соединений (не больше max_per_video и не больше
+# budget / число идущих загрузок) и возвращает ее по завершении. Встроенный движок между форматами
+# одного видео пересчитывает долю и забирает соединения, освобожденными завершившимися загрузками.
+# Каждой загрузке выдается хотя бы одно соединение, даже если бюджет уже исчерпан.
+_budget = {'budget': None, 'share': None}
+
+class FragmentBudget:
+    def __init__(self, total, max_per_video):
+        self.total = int(total)
+        self.max_per_video = int(max_per_video)
+        # Количество загрузок и выданных им соединений во всех процессах
+        self.active = multiprocessing.Value('i', 0)
+        self.allocated = multiprocessing.Value('i', 0, lock=False)
+
+    def _take(self, held):
+        # Вызывается под блокировкой active; held - доля, которую загрузка уже держит
+        available = self.total - (self.allocated.value - held)
+        share = max(1, min(self.max_per_video, self.total // max(1, self.active.value), available))
+        self.allocated.value += share - held
+        return share
+
+    def acquire(self):
+        with self.active.get_lock():
+            self.active.value += 1
+            return self._take(0)
+
+    def resize(self, share):
+        with self.active.get_lock():
+            return self._take(share)
+
+    def release(self, share):
+        with self.active.get_lock():
+            self.active.value -= 1
+            self.allocated.value -= share
+
+    @contextmanager
+    def slot(self):
+        share = self.acquire()
+        _budget['share'] = share
+        try:
+            yield
+        finally:
+            self.release(_budget['share'])
+            _budget['share'] = None
+
+def create_fragment_budget(config):
+    fragments_config = config.get('fragments', {})
+    if not fragments_config.get('enabled', True):
+        return None
+    return FragmentBudget(fragments_config.get('budget', 16), fragments_config.get('max_per_video', 8))
+
+def set_fragment_budget(budget):
+    _budget['budget'] = budget
+
+def get_fragment_concurrency(rebalance=False):
+    # Доля текущей загрузки; rebalance=True пересчитывает ее по текущей занятости бюджета
+    budget = _budget['budget']
+    if budget is None or _budget['share'] is None:
+        return None
+    if rebalance:
+        _budget['share'] = budget.resize(_budget['share'])
+    return _budget['share']
+
+@contextmanager
+def fragment_slot():
+    budget = _budget['budget']
+    if budget is None:
+        yield
+        return
+    with budget.slot():
+        yield
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import socket
+import uuid
+import sqlite3
+import threading
+
+# Общая очередь задач для распределенного режима. Задача - пара (выходная директория, URL видео)
+# в рамках прохода run_id; вместе с задачей хранится оценка длительности и размера видео из
+# перечисления плейлиста. Узел забирает задачи под аренду на lease_seconds и продлевает ее
+# пульсом; задачи упавшего узла возвращаются в очередь, когда его аренда истекает. Задача,
+# завершившаяся ошибкой, выдается снова, пока не исчерпан лимит выдач max_claims.
+#
+# Если run_id не задан, узел присоединяется к последнему незавершенному проходу (в нем остались
+# свободные, арендованные или упавшие задачи, либо задач еще нет), а иначе начинает новый:
+# повторный запуск после завершенного прохода снова публикует и проверяет все видео.
+#
+# Бэкенды:
+#   sqlite - файл SQLite на общей файловой системе (блокировки файла SQLite, журнал DELETE,
+#            так как WAL не работает на сетевых файловых системах)
+#   local  - очередь в памяти процесса, заменитель для одного узла и проверки режима
+
+def get_node_id(config):
+    return config.get('distributed', {}).get('node_id') or f"{socket.gethostname()}-{os.getpid()}"
+
+def get_journal_mode(config):
+    # На общей файловой системе все базы SQLite работают без WAL
+    return 'DELETE' if config.get('distributed', {}).get('enabled') else 'WAL'
+
+def new_run_id():
+    return time.strftime('%Y%m%d-%H%M%S') + f"-{uuid.uuid4().hex[:8]}"
+
+class SQLiteJobQueue:
+    def __init__(self, path, run_id, node_id, lease_seconds):
+        self.path = path
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.local = threading.local()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (run_id TEXT NOT NULL, output_dir TEXT NOT NULL, video_url TEXT NOT NULL, '
+                'state TEXT NOT NULL, owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, estimate TEXT, '
+                'PRIMARY KEY (run_id, output_dir, video_url))'
+            )
+            # Очередь, созданная до появления оценок, дополняется столбцом без пересоздания таблицы
+            if 'estimate' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+                conn.execute('ALTER TABLE jobs ADD COLUMN estimate TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (run_id, state, lease_until)')
+            conn.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at REAL NOT NULL)')
+            # Выбор прохода идет в той же транзакции, что и создание нового, чтобы одновременно
+            # запущенные узлы попали в один проход
+            self.run_id = run_id or self._select_run(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _select_run(self, conn):
+        row = conn.execute('SELECT run_id FROM runs ORDER BY started_at DESC LIMIT 1').fetchone()
+        if row is not None:
+            has_jobs = conn.execute('SELECT 1 FROM jobs WHERE run_id = ? LIMIT 1', (row[0],)).fetchone()
+            unfinished = conn.execute(
+                "SELECT 1 FROM jobs WHERE run_id = ? AND state IN ('pending', 'leased', 'failed') LIMIT 1", (row[0],)
+            ).fetchone()
+            if not has_jobs or unfinished:
+                return row[0]
+        run_id = new_run_id()
+        conn.execute('INSERT INTO runs (run_id, started_at) VALUES (?, ?)', (run_id, time.time()))
+        return run_id
+
+    def _connect(self):
+        # Отдельное соединение на поток: пульс аренды работает в своем потоке
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=DELETE')
+            self.local.conn = conn
+        return conn
+
+    def add_tasks(self, output_dir, video_urls, estimates=None):
+        # estimates - оценки видео из перечисления {URL видео: оценка}, выдаются вместе с задачей
+        estimates = estimates or {}
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (run_id, output_dir, video_url, state, estimate) VALUES (?, ?, ?, 'pending', ?)",
+                [(self.run_id, output_dir, video_url, json.dumps(estimates[video_url]) if video_url in estimates else None) for video_url in video_urls]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, limit, max_attempts):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Задачи с истекшей арендой или упавшие сверх лимита попыток больше не выдаются
+            conn.execute(
+                "UPDATE jobs SET state = 'dead', owner = NULL, error = COALESCE(error, 'lease expired') "
+                "WHERE run_id = ? AND ((state = 'leased' AND lease_until < ?) OR state = 'failed') AND attempts >= ?",
+                (self.run_id, now, max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT output_dir, video_url, estimate FROM jobs WHERE run_id = ? AND (state IN ('pending', 'failed') OR (state = 'leased' AND lease_until < ?)) "
+                "ORDER BY attempts, rowid LIMIT ?",
+                (self.run_id, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE run_id = ? AND output_dir = ? AND video_url = ?",
+                [(self.node_id, now + self.lease_seconds, self.run_id, output_dir, video_url) for output_dir, video_url, _ in rows]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [(output_dir, video_url, json.loads(estimate) if estimate else None) for output_dir, video_url, estimate in rows]
+
+    def heartbeat(self):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE run_id = ? AND state = 'leased' AND owner = ?",
+            (time.time() + self.lease_seconds, self.run_id, self.node_id)
+        )
+
+    def finish(self, output_dir, video_url, state, error=None):
+        # Узел фиксирует результат, только если аренда все еще за ним
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET state = ?, owner = NULL, lease_until = NULL, error = ? WHERE run_id = ? AND output_dir = ? AND video_url = ? AND owner = ?",
+            (state, error, self.run_id, output_dir, video_url, self.node_id)
+        )
+
+    def release(self, output_dir, video_url):
+        # Добровольный возврат задачи (прерывание узла) не расходует лимит выдач
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET state = 'pending', owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0) "
+            "WHERE run_id = ? AND output_dir = ? AND video_url = ? AND state = 'leased' AND owner = ?",
+            (self.run_id, output_dir, video_url, self.node_id)
+        )
+
+    def release_all(self):
+        # Корректное завершение узла: его задачи сразу возвращаются в очередь без расхода лимита выдач
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET state = 'pending', owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0) "
+            "WHERE run_id = ? AND state = 'leased' AND owner = ?",
+            (self.run_id, self.node_id)
+        )
+
+    def counts(self):
+        rows = self._connect().execute('SELECT state, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY state', (self.run_id,)).fetchall()
+        return dict(rows)
+
+    def dead_tasks(self):
+        return self._connect().execute(
+            "SELECT output_dir, video_url, attempts, error FROM jobs WHERE run_id = ? AND state IN ('dead', 'failed') ORDER BY output_dir, video_url",
+            (self.run_id,)
+        ).fetchall()
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+class LocalJobQueue:
+    def __init__(self, path, run_id, node_id, lease_seconds):
+        self.run_id = run_id or new_run_id()
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def add_tasks(self, output_dir, video_urls, estimates=None):
+        estimates = estimates or {}
+        with self.lock:
+            for video_url in video_urls:
+                self.jobs.setdefault((output_dir, video_url), {'state': 'pending', 'owner': None, 'lease_until': None, 'attempts': 0, 'error': None, 'estimate': estimates.get(video_url)})
+
+    def claim(self, limit, max_attempts):
+        now = time.time()
+        claimed = []
+        with self.lock:
+            for key, job in self.jobs.items():
+                expired = job['state'] == 'leased' and job['lease_until'] < now
+                if (expired or job['state'] == 'failed') and job['attempts'] >= max_attempts:
+                    job.update(state='dead', owner=None, error=job['error'] or 'lease expired')
+                elif (job['state'] in ('pending', 'failed') or expired) and len(claimed) < limit:
+                    job.update(state='leased', owner=self.node_id, lease_until=now + self.lease_seconds, attempts=job['attempts'] + 1)
+                    claimed.append((*key, job['estimate']))
+        return claimed
+
+    def heartbeat(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job['state'] == 'leased' and job['owner'] == self.node_id:
+                    job['lease_until'] = time.time() + self.lease_seconds
+
+    def finish(self, output_dir, video_url, state, error=None):
+        with self.lock:
+            job = self.jobs.get((output_dir, video_url))
+            if job and job['owner'] == self.node_id:
+                job.update(state=state, owner=None, lease_until=None, error=error)
+
+    def release(self, output_dir, video_url):
+        with self.lock:
+            job = self.jobs.get((output_dir, video_url))
+            if job and job['state'] == 'leased' and job['owner'] == self.node_id:
+                job.update(state='pending', owner=None, lease_until=None, attempts=max(job['attempts'] - 1, 0))
+
+    def release_all(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job['state'] == 'leased' and job['owner'] == self.node_id:
+                    job.update(state='pending', owner=None, lease_until=None, attempts=max(job['attempts'] - 1, 0))
+
+    def counts(self):
+        counts = {}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[job['state']] = counts.get(job['state'], 0) + 1
+        return counts
+
+    def dead_tasks(self):
+        with self.lock:
+            return sorted((output_dir, video_url, job['attempts'], job['error']) for (output_dir, video_url), job in self.jobs.items() if job['state'] in ('dead', 'failed'))
+
+    def close(self):
+        pass
+
+JOB_QUEUE_BACKENDS = {
+    'sqlite': SQLiteJobQueue,
+    'local': LocalJobQueue,
+}
+
+def open_job_queue(config):
+    distributed_config = config.get('distributed', {})
+    backend = distributed_config.get('backend', 'sqlite')
+    if backend not in JOB_QUEUE_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд очереди задач: {backend}")
+    path = distributed_config.get('queue_path') or os.path.join(config['output_dir'], 'job_queue.sqlite')
+    return JOB_QUEUE_BACKENDS[backend](path, str(distributed_config.get('run_id') or '') or None, get_node_id(config), distributed_config.get('lease_seconds', 300))
@@ -1,37 +1,127 @@
 import logging
+import logging.handlers
 import os
+import json
 import multiprocessing
 import re
 
-def setup_logging(config, worker=False):
-    log_level = logging.INFO
-    log_format = '%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+# Все логгеры приложения - потомки одного корневого логгера. Родительский процесс владеет
+# единственным QueueListener, который пишет в консоль и в общий JSON lines файл;
+# родитель и воркеры только кладут записи в очередь через QueueHandler.
+ROOT_LOGGER = 'downloader'
+LOG_FORMAT = '%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+# Дополнительные поля записи (logger.info(..., extra={...})), попадающие в структурированный лог
+STRUCTURED_FIELDS = ('video_id', 'video_url', 'stage', 'bytes')
 
-    if worker:
-        logger = logging.getLogger(f'worker_{multiprocessing.current_process().name}')
-    else:
-        logger = logging.getLogger('main')
+_log_state = {'configured': False, 'queue': None, 'listener': None, 'handlers': []}
 
-    logger.setLevel(log_level)
+PERCENT_PATTERN = re.compile(r'\d+\.\d+%')
 
-    if not logger.handlers:
-        if config['logging']['console_logging']:
-            console_handler = logging.StreamHandler()
-            console_handler.setFormatter(logging.Formatter(log_format))
-            logger.addHandler(console_handler)
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'component': record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name,
+            'process': record.processName,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
 
-        if config['logging']['file_logging']:
-            log_dir = config['logging']['log_dir']
-            os.makedirs(log_dir, exist_ok=True)
-            if worker:
-                log_file = os.path.join(log_dir, f'downloader_worker_{multiprocessing.current_process().name}.log')
-            else:
-                log_file = os.path.join(log_dir, 'downloader.log')
-            file_handler = logging.FileHandler(log_file, encoding='utf-8')
-            file_handler.setFormatter(logging.Formatter(log_format))
-            logger.addHandler(file_handler)
+def _get_level(value, default=logging.INFO):
+    if isinstance(value, int):
+        return value
+    return logging.getLevelName(str(value).upper()) if value else default
 
-    return logger
+def _build_handlers(config):
+    logging_config = config['logging']
+    handlers = []
+    if logging_config['console_logging']:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(console_handler)
+
+    if logging_config['file_logging']:
+        log_dir = logging_config['log_dir']
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.FileHandler(os.path.join(log_dir, 'downloader.jsonl'), encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    return handlers
+
+def _configure(config, with_handlers=True):
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(_get_level(config['logging'].get('level')))
+    root.propagate = False
+    # Уровни отдельных компонентов: main, worker, metadata, ytdlp, scheduler, ...
+    for component, level in (config['logging'].get('levels') or {}).items():
+        get_component_logger(component).setLevel(_get_level(level))
+    if with_handlers and not root.handlers:
+        _log_state['handlers'] = _build_handlers(config)
+        for handler in _log_state['handlers']:
+            root.addHandler(handler)
+    _log_state['configured'] = True
+
+def get_component_logger(component):
+    return logging.getLogger(f'{ROOT_LOGGER}.{component}')
+
+def setup_logging(config, worker=False, component=None):
+    if not _log_state['configured']:
+        _configure(config)
+    return get_component_logger(component or ('worker' if worker else 'main'))
+
+def start_log_listener(config):
+    # Родительский процесс переводит обработчики в поток QueueListener; очередь передается воркерам
+    if _log_state['listener'] is not None:
+        return _log_state['queue']
+    setup_logging(config)
+    root = logging.getLogger(ROOT_LOGGER)
+    log_queue = multiprocessing.Queue()
+    for handler in _log_state['handlers']:
+        root.removeHandler(handler)
+    listener = logging.handlers.QueueListener(log_queue, *_log_state['handlers'], respect_handler_level=True)
+    listener.start()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_state.update(queue=log_queue, listener=listener)
+    return log_queue
+
+def stop_log_listener():
+    listener = _log_state['listener']
+    if listener is None:
+        return
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    listener.stop()
+    for handler in _log_state['handlers']:
+        root.addHandler(handler)
+    _log_state.update(queue=None, listener=None)
+
+def set_log_queue(log_queue, config):
+    # Вызывается в воркере: все записи уходят в очередь родительского процесса
+    _configure(config, with_handlers=False)
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_state.update(queue=log_queue, handlers=[])
+
+def classify_yt_dlp_line(line):
+    # Горячий цикл чтения вывода yt-dlp: дешевые проверки префиксов вместо регулярного выражения на каждую строку
+    if line.startswith('[download]'):
+        if 'Destination:' in line:
+            return 'destination'
+        return 'progress' if '%' in line else None
+    if line.startswith('ERROR:'):
+        return 'error'
+    if line.startswith('WARNING:'):
+        return 'warning'
+    return None
 
 def filter_yt_dlp_output(output):
     lines = output.split('\n')
@@ -41,7 +131,7 @@ def filter_yt_dlp_output(output):
         if "WARNING:" in line:
             continue
         # Оставляем строки с процентами загрузки или информацией о назначении
-        if re.search(r'\d+\.\d+%|Destination:', line) and 'player=' not in line:
+        if ('Destination:' in line or PERCENT_PATTERN.search(line)) and 'player=' not in line:
             filtered.append(line)
         # Добавляем информацию об ошибках, если они есть
         elif "ERROR:" in line:
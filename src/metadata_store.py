@@ -0,0 +1,277 @@
+import csv
+import os
+import sqlite3
+import uuid
+from .logging_utils import setup_logging
+from .job_queue import get_journal_mode
+
+# Точный список полей, которые сохраняются в базе и выгружаются в CSV
+REQUIRED_FIELDS = ['id', 'file_name', 'height', 'width', 'fps', 'duration', 'sample_rate', 'audio_channels', 'file_size', 'video_url', 'title', 'platform']
+# Идентификаторы уникальны только в пределах платформы
+KEY_FIELDS = ('platform', 'id')
+# Ограничение числа параметров запроса в старых версиях SQLite
+QUERY_CHUNK_SIZE = 500
+
+def get_metadata_db_path(config):
+    db_path = config.get('metadata', {}).get('db_path')
+    return db_path or os.path.join(config['output_dir'], 'video_metadata.sqlite')
+
+def open_metadata_store(config):
+    conn = sqlite3.connect(get_metadata_db_path(config), timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA journal_mode={get_journal_mode(config)}')
+    columns = ', '.join(f"{field} TEXT NOT NULL DEFAULT ''" if field in KEY_FIELDS else field for field in REQUIRED_FIELDS)
+    _create_table(conn, 'videos', f"{columns}, PRIMARY KEY ({', '.join(KEY_FIELDS)})")
+    # Принадлежность видео к выходной директории (плейлисту); в базах прежней версии платформа берется из videos
+    _create_table(
+        conn, 'playlist_videos',
+        "output_dir TEXT NOT NULL, platform TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, PRIMARY KEY (output_dir, platform, id)",
+        "UPDATE playlist_videos SET platform = COALESCE((SELECT v.platform FROM videos v WHERE v.id = playlist_videos.id LIMIT 1), '') WHERE platform = ''"
+    )
+    # Манифест завершенных загрузок для инкрементальной синхронизации; в базах прежней версии
+    # платформа берется из принадлежности видео к той же директории
+    _create_table(
+        conn, 'manifest',
+        "output_dir TEXT NOT NULL, platform TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, quality TEXT NOT NULL, "
+        'file_name TEXT NOT NULL, file_size INTEGER NOT NULL, PRIMARY KEY (output_dir, platform, id)',
+        _fill_platform_sql('manifest')
+    )
+    # Результаты постобработки (аудио, кадры, клипы) с параметрами, с которыми они получены
+    _create_table(
+        conn, 'postprocess_outputs',
+        "output_dir TEXT NOT NULL, platform TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, task TEXT NOT NULL, "
+        'params TEXT NOT NULL, source_size INTEGER NOT NULL, output TEXT NOT NULL, PRIMARY KEY (output_dir, platform, id, task)',
+        _fill_platform_sql('postprocess_outputs')
+    )
+    conn.commit()
+    return conn
+
+def _fill_platform_sql(table):
+    return (
+        f"UPDATE {table} SET platform = COALESCE((SELECT p.platform FROM playlist_videos p "
+        f"WHERE p.output_dir = {table}.output_dir AND p.id = {table}.id LIMIT 1), '') WHERE platform = ''"
+    )
+
+def _table_columns(conn, table, schema='main'):
+    # Имена столбцов и их позиции в первичном ключе
+    return [(row[1], row[5]) for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def _create_table(conn, table, definition, migrate_sql=None):
+    # Таблица из базы прежней версии с другими столбцами или первичным ключом пересоздается с переносом
+    # общих столбцов (без ALTER TABLE DROP COLUMN, которого нет в старых версиях SQLite);
+    # migrate_sql дозаполняет новые столбцы перенесенных строк
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({definition})')
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS _{table}_schema ({definition})')
+    expected = _table_columns(conn, f'_{table}_schema', 'temp')
+    conn.execute(f'DROP TABLE temp._{table}_schema')
+    if _table_columns(conn, table) == expected:
+        return
+    with conn:
+        # Проверка повторяется под блокировкой: базу может одновременно переносить другой узел
+        conn.execute('BEGIN IMMEDIATE')
+        existing = _table_columns(conn, table)
+        if existing == expected:
+            return
+        existing_names = {name for name, _ in existing}
+        columns = ', '.join(name for name, _ in expected if name in existing_names)
+        conn.execute(f'ALTER TABLE {table} RENAME TO _{table}_old')
+        conn.execute(f'CREATE TABLE {table} ({definition})')
+        # Пустые ключевые значения заменяются значением по умолчанию (OR REPLACE для NOT NULL)
+        conn.execute(f'INSERT OR REPLACE INTO {table} ({columns}) SELECT {columns} FROM _{table}_old')
+        conn.execute(f'DROP TABLE _{table}_old')
+        if migrate_sql:
+            conn.execute(migrate_sql)
+
+def _normalize_dir(output_dir):
+    return os.path.normcase(os.path.abspath(output_dir))
+
+def _upsert_rows(conn, rows, output_dir):
+    placeholders = ', '.join('?' for _ in REQUIRED_FIELDS)
+    updates = ', '.join(f'{field} = excluded.{field}' for field in REQUIRED_FIELDS if field not in KEY_FIELDS)
+    conn.executemany(
+        f"INSERT INTO videos ({', '.join(REQUIRED_FIELDS)}) VALUES ({placeholders}) "
+        f"ON CONFLICT({', '.join(KEY_FIELDS)}) DO UPDATE SET {updates}",
+        [tuple((row.get(field) or '') if field in KEY_FIELDS else row.get(field) for field in REQUIRED_FIELDS) for row in rows]
+    )
+    conn.executemany(
+        'INSERT OR IGNORE INTO playlist_videos (output_dir, platform, id) VALUES (?, ?, ?)',
+        [(_normalize_dir(output_dir), row.get('platform') or '', row['id']) for row in rows]
+    )
+
+def _import_existing_csv(conn, output_dir, logger):
+    # Однократный перенос уже существующего video_metadata.csv, чтобы выгрузка не потеряла старые строки
+    csv_path = os.path.join(output_dir, 'video_metadata.csv')
+    has_rows = conn.execute('SELECT 1 FROM playlist_videos WHERE output_dir = ? LIMIT 1', (_normalize_dir(output_dir),)).fetchone()
+    if has_rows or not os.path.isfile(csv_path):
+        return
+    with open(csv_path, 'r', encoding='utf-8-sig') as csvfile:
+        rows = [row for row in csv.DictReader(csvfile) if row.get('id')]
+    if rows:
+        _upsert_rows(conn, rows, output_dir)
+        logger.info(f"Импортировано {len(rows)} записей из {csv_path}")
+
+def upsert_metadata_batch(metadata_list, output_dir, config):
+    logger = setup_logging(config, component='metadata')
+    try:
+        conn = open_metadata_store(config)
+        try:
+            # Вся пачка записывается одной транзакцией
+            with conn:
+                _import_existing_csv(conn, output_dir, logger)
+                _upsert_rows(conn, metadata_list, output_dir)
+        finally:
+            conn.close()
+        logger.info(f"Метаданные {len(metadata_list)} видео сохранены в базе: {get_metadata_db_path(config)}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении метаданных в базу: {e}")
+        return False
+
+def load_stored_metadata(video_keys, config):
+    # Сохраненные метаданные пачки видео одним соединением: {(платформа, id): строка}
+    db_path = get_metadata_db_path(config)
+    video_keys = set(video_keys)
+    if not video_keys or not os.path.isfile(db_path):
+        return {}
+    video_ids = sorted({video_id for _, video_id in video_keys})
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    rows = []
+    try:
+        for start in range(0, len(video_ids), QUERY_CHUNK_SIZE):
+            chunk = video_ids[start:start + QUERY_CHUNK_SIZE]
+            rows.extend(conn.execute(f"SELECT * FROM videos WHERE id IN ({', '.join('?' for _ in chunk)})", chunk).fetchall())
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    stored = {}
+    for row in rows:
+        key = (row['platform'], row['id'])
+        if key in video_keys:
+            stored[key] = dict(row)
+    return stored
+
+def load_dir_metadata(output_dir, config):
+    # Сохраненные метаданные всех видео выходной директории; базу не создает, если ее еще нет
+    db_path = get_metadata_db_path(config)
+    if not os.path.isfile(db_path):
+        return []
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT v.* FROM videos v JOIN playlist_videos p ON p.platform = v.platform AND p.id = v.id WHERE p.output_dir = ?",
+            (_normalize_dir(output_dir),)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+def export_metadata_to_csv(output_dir, config):
+    logger = setup_logging(config, component='metadata')
+    csv_path = os.path.join(output_dir, 'video_metadata.csv')
+    try:
+        conn = open_metadata_store(config)
+        try:
+            with conn:
+                _import_existing_csv(conn, output_dir, logger)
+            rows = conn.execute(
+                f"SELECT {', '.join('v.' + field for field in REQUIRED_FIELDS)} FROM videos v "
+                "JOIN playlist_videos p ON p.platform = v.platform AND p.id = v.id WHERE p.output_dir = ? ORDER BY v.id",
+                (_normalize_dir(output_dir),)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        # Запись во временный файл и атомарная замена, чтобы не оставить обрезанный CSV;
+        # имя временного файла уникально, так как выгрузку могут выполнять несколько узлов
+        tmp_path = f"{csv_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=REQUIRED_FIELDS)
+            writer.writeheader()
+            writer.writerows(dict(row) for row in rows)
+        os.replace(tmp_path, csv_path)
+
+        logger.info(f"Метаданные выгружены в файл: {csv_path}")
+        return csv_path
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке метаданных в CSV: {e}")
+        return None
+
+def load_manifest(output_dir, config):
+    db_path = get_metadata_db_path(config)
+    if not os.path.isfile(db_path):
+        return {}
+    conn = open_metadata_store(config)
+    try:
+        rows = conn.execute('SELECT * FROM manifest WHERE output_dir = ?', (_normalize_dir(output_dir),)).fetchall()
+    finally:
+        conn.close()
+    return {(row['platform'], row['id']): dict(row) for row in rows}
+
+def record_manifest_batch(metadata_list, output_dir, video_quality, config):
+    logger = setup_logging(config, component='metadata')
+    try:
+        conn = open_metadata_store(config)
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO manifest (output_dir, platform, id, quality, file_name, file_size) VALUES (?, ?, ?, ?, ?, ?)',
+                    [
+                        (_normalize_dir(output_dir), metadata.get('platform') or '', metadata['id'], video_quality or 'best', metadata['file_name'], int(metadata['file_size']))
+                        for metadata in metadata_list
+                    ]
+                )
+        finally:
+            conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении манифеста загрузок: {e}")
+        return False
+
+def is_manifest_satisfied(entry, output_dir, video_quality):
+    # Элемент считается готовым, если совпадает целевое качество, а файл на месте и не изменил размер
+    if entry is None or entry['quality'] != (video_quality or 'best'):
+        return False
+    try:
+        return os.path.getsize(os.path.join(output_dir, entry['file_name'])) == entry['file_size']
+    except OSError:
+        return False
+
+def load_postprocess_records(output_dir, config):
+    db_path = get_metadata_db_path(config)
+    if not os.path.isfile(db_path):
+        return {}
+    conn = open_metadata_store(config)
+    try:
+        rows = conn.execute('SELECT * FROM postprocess_outputs WHERE output_dir = ?', (_normalize_dir(output_dir),)).fetchall()
+    finally:
+        conn.close()
+    records = {}
+    for row in rows:
+        records.setdefault((row['platform'], row['id']), {})[row['task']] = dict(row)
+    return records
+
+def record_postprocess_batch(postprocess_outputs, output_dir, config):
+    # postprocess_outputs - список (платформа, id видео, записи результатов), вся пачка записывается одной транзакцией
+    logger = setup_logging(config, component='metadata')
+    try:
+        conn = open_metadata_store(config)
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO postprocess_outputs (output_dir, platform, id, task, params, source_size, output) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (_normalize_dir(output_dir), platform or '', video_id, record['task'], record['params'], record['source_size'], record['output'])
+                        for platform, video_id, records in postprocess_outputs for record in records
+                    ]
+                )
+        finally:
+            conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результатов постобработки: {e}")
+        return False
@@ -1,13 +1,14 @@
 import csv
 import os
 import json
-from yt_dlp import YoutubeDL
-from ffprobe import FFProbe
 from .logging_utils import setup_logging
 from .url_utils import get_video_id
+from .ytdlp_engine import extract_video_info
+from .probe_cache import is_probe_cache_enabled, lookup_probe_cache, store_probe_cache
+from .mp4_reader import MP4_EXTENSIONS, is_mp4_reader_enabled, read_mp4_metadata
 
 def cleanup_info_json_files(output_dir, config):
-    logger = setup_logging(config)
+    logger = setup_logging(config, component='metadata')
     for filename in os.listdir(output_dir):
         if filename.endswith('.info.json'):
             file_path = os.path.join(output_dir, filename)
@@ -17,36 +18,58 @@ def cleanup_info_json_files(output_dir, config):
             except Exception as e:
                 logger.error(f"Не удалось удалить файл {file_path}: {e}")
 
+def probe_file_metadata(file_path):
+    # Модуль ffprobe нужен только при промахе кэша
+    from ffprobe import FFProbe
+    metadata = FFProbe(file_path)
+    video_stream = next((s for s in metadata.streams if s.is_video()), None)
+    audio_stream = next((s for s in metadata.streams if s.is_audio()), None)
+
+    def safe_get(obj, attr):
+        return getattr(obj, attr, 'N/A') if obj else 'N/A'
+
+    duration = safe_get(video_stream, 'duration')
+    if duration == 'N/A' and video_stream:
+        time_base = safe_get(video_stream, 'time_base')
+        nb_frames = safe_get(video_stream, 'nb_frames')
+        if time_base != 'N/A' and nb_frames != 'N/A':
+            duration = float(time_base) * int(nb_frames)
+
+    return {
+        'duration': duration,
+        'fps': safe_get(video_stream, 'framerate'),
+        'sample_rate': safe_get(audio_stream, 'sample_rate'),
+        'channels': safe_get(audio_stream, 'channels'),
+        'width': safe_get(video_stream, 'width'),
+        'height': safe_get(video_stream, 'height')
+    }
+
 def get_file_metadata(file_path, config):
-    logger = setup_logging(config, worker=True)
+    logger = setup_logging(config, component='metadata')
+    use_cache = is_probe_cache_enabled(config)
     try:
-        metadata = FFProbe(file_path)
-        video_stream = next((s for s in metadata.streams if s.is_video()), None)
-        audio_stream = next((s for s in metadata.streams if s.is_audio()), None)
-
-        def safe_get(obj, attr):
-            return getattr(obj, attr, 'N/A') if obj else 'N/A'
-
-        duration = safe_get(video_stream, 'duration')
-        if duration == 'N/A' and video_stream:
-            time_base = safe_get(video_stream, 'time_base')
-            nb_frames = safe_get(video_stream, 'nb_frames')
-            if time_base != 'N/A' and nb_frames != 'N/A':
-                duration = float(time_base) * int(nb_frames)
-
-        result = {
-            'duration': duration,
-            'fps': safe_get(video_stream, 'framerate'),
-            'sample_rate': safe_get(audio_stream, 'sample_rate'),
-            'channels': safe_get(audio_stream, 'channels'),
-            'width': safe_get(video_stream, 'width'),
-            'height': safe_get(video_stream, 'height')
-        }
+        if use_cache:
+            stat = os.stat(file_path)
+            cached_result = lookup_probe_cache(file_path, stat, config)
+            if cached_result is not None:
+                logger.debug(f"Метаданные файла {file_path} взяты из кэша ffprobe")
+                return cached_result
+
+        # Для mp4 метаданные читаются из заголовка файла без запуска ffprobe
+        result = None
+        if is_mp4_reader_enabled(config) and file_path.lower().endswith(MP4_EXTENSIONS):
+            result = read_mp4_metadata(file_path)
+            if result is None:
+                logger.debug(f"Заголовок mp4 {file_path} не разобран, метаданные будут получены через ffprobe")
+        if result is None:
+            result = probe_file_metadata(file_path)
 
         logger.info(f"Извлеченные метаданные файла для {file_path}: {result}")
 
         if all(value == 'N/A' for value in result.values()):
             logger.warning(f"Все метаданные для {file_path} имеют значение 'N/A'. Возможно, проблема с извлечением данных.")
+        elif use_cache:
+            store_probe_cache(file_path, stat, result, config)
 
         return result
     except Exception as e:
@@ -54,7 +77,7 @@ def get_file_metadata(file_path, config):
         return {}
 
 def update_metadata_to_csv(metadata, output_dir, config):
-    logger = setup_logging(config)
+    logger = setup_logging(config, component='metadata')
     csv_path = os.path.join(output_dir, 'video_metadata.csv')
 
     # Определяем точный список полей, которые нужно сохранить
@@ -93,7 +116,7 @@ def update_metadata_to_csv(metadata, output_dir, config):
         return None
 
 def update_metadata(video_id, new_metadata, output_dir, config):
-    logger = setup_logging(config, worker=True)
+    logger = setup_logging(config, component='metadata')
     json_path = os.path.join(output_dir, f"{video_id}_metadata.json")
     try:
         if os.path.exists(json_path):
@@ -114,7 +137,7 @@ def update_metadata(video_id, new_metadata, output_dir, config):
 
 def get_cached_metadata(video_id, output_dir, config):
 
-    logger = setup_logging(config, worker=True)
+    logger = setup_logging(config, component='metadata')
     json_path = os.path.join(output_dir, f"{video_id}_metadata.json")
     if os.path.exists(json_path):
         try:
@@ -136,21 +159,26 @@ def compare_metadata(old_metadata, new_metadata):
             differences[key] = ('Изменено', old_metadata[key], new_metadata[key])
     return differences
 
-def process_video_metadata(video_url, file_path, output_dir, config):
-    logger = setup_logging(config, worker=True)
+def process_video_metadata(video_url, file_path, output_dir, config, info=None, file_metadata=None, stored_metadata=None):
+    logger = setup_logging(config, component='metadata')
     # video_id = get_video_id(video_url)
     platform, video_id = get_video_id(video_url)
 
-    # Проверяем наличие кэшированных метаданных
-    cached_metadata = get_cached_metadata(video_id, output_dir, config)
+    # Проверяем наличие кэшированных метаданных: в JSON файле, если он включен, иначе строка базы метаданных,
+    # прочитанная пачкой при подготовке задач
+    json_files = config.get('metadata', {}).get('json_files', False)
+    if json_files:
+        cached_metadata = get_cached_metadata(video_id, output_dir, config)
+    else:
+        cached_metadata = stored_metadata
 
-    # Получаем метаданные из файла
-    file_metadata = get_file_metadata(file_path, config)
+    # Получаем метаданные из файла, если они не были получены на стадии анализа
+    if file_metadata is None:
+        file_metadata = get_file_metadata(file_path, config)
 
-    # Получаем минимальную информацию из YouTube
-    ydl_opts = {'quiet': True}
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(video_url, download=False)
+    # Информация о видео берется из загрузки; если ее нет, извлекаем через "прогретый" экземпляр YoutubeDL
+    if info is None:
+        info = extract_video_info(video_url)
 
     new_metadata = {
         'id': video_id,
@@ -176,7 +204,8 @@ def process_video_metadata(video_url, file_path, output_dir, config):
             logger.info(f"Метаданные для видео {video_id} не изменились")
 
     # Обновляем метаданные в JSON файле
-    update_metadata(video_id, new_metadata, output_dir, config)
+    if json_files:
+        update_metadata(video_id, new_metadata, output_dir, config)
 
     # Проверка наличия всех необходимых метаданных
     required_fields = ['id', 'file_name', 'height', 'width', 'fps', 'duration', 'sample_rate', 'audio_channels', 'file_size', 'video_url', 'title', 'platform']
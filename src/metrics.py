@@ -0,0 +1,160 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def record_timing(job, stage, seconds, num_bytes=0):
+    # Замеры воркера сохраняются в самой задаче и вместе с ней возвращаются в родительский процесс
+    job.setdefault('timings', []).append({'stage': stage, 'seconds': seconds, 'bytes': num_bytes})
+
+@contextmanager
+def timed_stage(job, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(job, stage, time.perf_counter() - start)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    # Метод ближайшего ранга
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class RunMetrics:
+    def __init__(self, max_samples=None):
+        # max_samples - сколько последних замеров каждой стадии и видео хранится для квантилей и отчета
+        # (None - все; долгий запуск в режиме наблюдения). count и sum считаются по всем замерам
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.stage_seconds = {}
+        self.stage_bytes = {}
+        self.queue_waits = {}
+        self.videos = deque(maxlen=max_samples)
+        self.videos_total = 0
+
+    def _append(self, samples, stage, value):
+        sample = samples.get(stage)
+        if sample is None:
+            sample = samples[stage] = {'values': deque(maxlen=self.max_samples), 'count': 0, 'sum': 0.0}
+        sample['values'].append(value)
+        sample['count'] += 1
+        sample['sum'] += value
+
+    def add(self, stage, seconds, num_bytes=0):
+        with self.lock:
+            self._append(self.stage_seconds, stage, seconds)
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + (num_bytes or 0)
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add_queue_wait(self, stage, seconds):
+        with self.lock:
+            self._append(self.queue_waits, stage, seconds)
+
+    def add_job(self, job):
+        timings = job.get('timings') or []
+        for timing in timings:
+            self.add(timing['stage'], timing['seconds'], timing['bytes'])
+        with self.lock:
+            self.videos_total += 1
+            self.videos.append({
+                'video_id': job.get('video_id'),
+                'video_url': job.get('video_url'),
+                'success': job.get('success', False),
+                'stages': timings,
+                'queue_wait': job.get('queue_waits', {}),
+            })
+
+    def _summary(self, sample):
+        values = sorted(sample['values'])
+        summary = {f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES}
+        summary.update(count=sample['count'], sum=sample['sum'])
+        return summary
+
+    def build_report(self):
+        wall_time = time.time() - self.started
+        total_bytes = self.stage_bytes.get('download', 0)
+        stages = {}
+        with self.lock:
+            stage_seconds = {stage: dict(sample, values=list(sample['values'])) for stage, sample in self.stage_seconds.items()}
+            queue_waits = {stage: dict(sample, values=list(sample['values'])) for stage, sample in self.queue_waits.items()}
+            videos = list(self.videos)
+        for stage, sample in stage_seconds.items():
+            stages[stage] = self._summary(sample)
+            stages[stage]['bytes'] = self.stage_bytes.get(stage, 0)
+            busy = stages[stage]['sum']
+            stages[stage]['mb_per_s'] = stages[stage]['bytes'] / (1024 * 1024) / busy if busy else 0.0
+        return {
+            'started_at': self.started,
+            'wall_time': wall_time,
+            'total_bytes': total_bytes,
+            'mb_per_s': total_bytes / (1024 * 1024) / wall_time if wall_time else 0.0,
+            'stages': stages,
+            'queue_wait': {stage: self._summary(sample) for stage, sample in queue_waits.items()},
+            # При ограничении max_samples в отчете только последние видео; videos_total - все обработанные
+            'videos_total': self.videos_total,
+            'videos': videos,
+        }
+
+    def format_prometheus(self, report):
+        lines = [
+            '# HELP video_downloader_stage_seconds Длительность стадии обработки одного видео',
+            '# TYPE video_downloader_stage_seconds summary',
+        ]
+        for stage, summary in report['stages'].items():
+            for q in QUANTILES:
+                lines.append(f'video_downloader_stage_seconds{{stage="{stage}",quantile="{q}"}} {summary[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'video_downloader_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'video_downloader_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        lines += [
+            '# HELP video_downloader_stage_bytes_total Объем данных, обработанных стадией',
+            '# TYPE video_downloader_stage_bytes_total counter',
+        ]
+        for stage, summary in report['stages'].items():
+            lines.append(f'video_downloader_stage_bytes_total{{stage="{stage}"}} {summary["bytes"]}')
+        lines += [
+            '# HELP video_downloader_queue_wait_seconds Время ожидания задачи в очереди стадии',
+            '# TYPE video_downloader_queue_wait_seconds summary',
+        ]
+        for stage, summary in report['queue_wait'].items():
+            for q in QUANTILES:
+                lines.append(f'video_downloader_queue_wait_seconds{{stage="{stage}",quantile="{q}"}} {summary[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'video_downloader_queue_wait_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'video_downloader_queue_wait_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        lines += [
+            '# HELP video_downloader_throughput_mb_per_second Средняя скорость загрузки за запуск',
+            '# TYPE video_downloader_throughput_mb_per_second gauge',
+            f'video_downloader_throughput_mb_per_second {report["mb_per_s"]:.6f}',
+            '# HELP video_downloader_wall_time_seconds Длительность запуска',
+            '# TYPE video_downloader_wall_time_seconds gauge',
+            f'video_downloader_wall_time_seconds {report["wall_time"]:.6f}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_dir, name='run_report'):
+        os.makedirs(report_dir, exist_ok=True)
+        report = self.build_report()
+        json_path = os.path.join(report_dir, f'{name}.json')
+        prom_path = os.path.join(report_dir, f'{name}.prom')
+        # Отчет может перезаписываться во время работы (режим наблюдения): читатель видит только целый файл
+        with open(json_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(json_path + '.tmp', json_path)
+        with open(prom_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.format_prometheus(report))
+        os.replace(prom_path + '.tmp', prom_path)
+        return json_path
@@ -0,0 +1,122 @@
+import mmap
+import struct
+
+# Чтение метаданных mp4 напрямую из заголовка, без запуска ffprobe: файл отображается в память,
+# и разбираются только боксы moov/trak/mdia/mdhd/hdlr/stsd/stsz. Данные mdat не читаются,
+# поэтому время не зависит от размера файла. Возвращает словарь того же вида, что и ffprobe путь
+# get_file_metadata, или None, если файл нужно отдать ffprobe (фрагментированный mp4, нет moov и т.п.).
+
+MP4_EXTENSIONS = ('.mp4', '.m4a', '.m4v', '.mov')
+
+def is_mp4_reader_enabled(config):
+    return config.get('metadata', {}).get('mp4_reader', True)
+
+def _iter_boxes(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        box_size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size or offset + box_size > end:
+            raise ValueError(f"бокс {box_type!r} выходит за границы родительского бокса")
+        yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+def _child_boxes(data, start, end):
+    # {тип: (начало содержимого, конец)} для первого бокса каждого типа
+    children = {}
+    for box_type, box_start, box_end in _iter_boxes(data, start, end):
+        children.setdefault(box_type, (box_start, box_end))
+    return children
+
+def _parse_track(data, start, end):
+    mdia = _child_boxes(data, start, end).get(b'mdia')
+    if mdia is None:
+        return None
+    mdia_boxes = _child_boxes(data, *mdia)
+    if b'mdhd' not in mdia_boxes or b'hdlr' not in mdia_boxes or b'minf' not in mdia_boxes:
+        return None
+
+    mdhd = mdia_boxes[b'mdhd'][0]
+    if data[mdhd] == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, mdhd + 20)
+        unknown_duration = 0xFFFFFFFFFFFFFFFF
+    else:
+        timescale, duration = struct.unpack_from('>II', data, mdhd + 12)
+        unknown_duration = 0xFFFFFFFF
+    track = {
+        'handler': bytes(data[mdia_boxes[b'hdlr'][0] + 8:mdia_boxes[b'hdlr'][0] + 12]),
+        'timescale': timescale,
+        'duration': 0 if duration == unknown_duration else duration,
+        'samples': 0,
+    }
+
+    stbl = _child_boxes(data, *mdia_boxes[b'minf']).get(b'stbl')
+    if stbl is None:
+        return None
+    stbl_boxes = _child_boxes(data, *stbl)
+    if b'stsz' in stbl_boxes:
+        track['samples'] = struct.unpack_from('>I', data, stbl_boxes[b'stsz'][0] + 8)[0]
+    if b'stsd' not in stbl_boxes:
+        return track
+
+    # Первая запись stsd: 8 байт заголовка записи, затем 6 байт резерва и индекс data reference
+    entry = stbl_boxes[b'stsd'][0] + 8 + 8
+    if track['handler'] == b'vide':
+        track['width'], track['height'] = struct.unpack_from('>HH', data, entry + 24)
+    elif track['handler'] == b'soun':
+        version = struct.unpack_from('>H', data, entry + 8)[0]
+        if version == 2:
+            # Звуковая запись QuickTime версии 2: частота - float64, число каналов - отдельное поле
+            sample_rate, channels = struct.unpack_from('>dI', data, entry + 32)
+        else:
+            channels = struct.unpack_from('>H', data, entry + 16)[0]
+            sample_rate = struct.unpack_from('>I', data, entry + 24)[0] >> 16
+        # Частоты выше 65535 Гц не помещаются в поле 16.16: берем шкалу времени дорожки
+        track['sample_rate'] = int(sample_rate) or timescale
+        track['channels'] = channels
+    return track
+
+def _parse_moov(data):
+    moov = _child_boxes(data, 0, len(data)).get(b'moov')
+    if moov is None:
+        return None
+    tracks = []
+    for box_type, box_start, box_end in _iter_boxes(data, *moov):
+        if box_type == b'trak':
+            track = _parse_track(data, box_start, box_end)
+            if track is not None:
+                tracks.append(track)
+    return tracks
+
+def read_mp4_metadata(file_path):
+    try:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tracks = _parse_moov(data)
+    except (OSError, ValueError, struct.error):
+        # Пустой файл (mmap не отображает 0 байт), обрезанный или поврежденный заголовок
+        return None
+    if not tracks:
+        return None
+
+    video = next((track for track in tracks if track['handler'] == b'vide' and 'width' in track), None)
+    audio = next((track for track in tracks if track['handler'] == b'soun' and 'channels' in track), None)
+    if video is None and audio is None:
+        return None
+    # У фрагментированного mp4 длительность и число кадров хранятся в moof, а не в moov
+    if video is not None and not (video['timescale'] and video['duration'] and video['samples']):
+        return None
+
+    # Значения в том же виде, что выдает ffprobe -show_streams: строки и округленная частота кадров
+    return {
+        'duration': f"{video['duration'] / video['timescale']:.6f}" if video else 'N/A',
+        'fps': round(video['samples'] * video['timescale'] / video['duration']) if video else 'N/A',
+        'sample_rate': str(audio['sample_rate']) if audio else 'N/A',
+        'channels': str(audio['channels']) if audio else 'N/A',
+        'width': str(video['width']) if video else 'N/A',
+        'height': str(video['height']) if video else 'N/A'
+    }
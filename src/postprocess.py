@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import subprocess
+import uuid
+from .subprocess_utils import subprocess_run_context
+
+# Обработка загруженных видео для датасета: извлечение аудио, выборка кадров и нарезка клипов.
+# Результаты пишутся в <папка плейлиста>/postprocess/<задача>/, а их параметры сохраняются
+# в базе метаданных: при повторном запуске задача с теми же параметрами для того же файла пропускается.
+
+class PostprocessCancelled(Exception):
+    pass
+
+def is_postprocess_enabled(config):
+    return config.get('postprocess', {}).get('enabled', False)
+
+def get_task_params(config):
+    # Параметры включенных задач: {задача: параметры без ключа enabled}
+    tasks = config.get('postprocess', {}).get('tasks') or {}
+    return {
+        task: {key: value for key, value in (task_config or {}).items() if key != 'enabled'}
+        for task, task_config in tasks.items()
+        if task in POSTPROCESS_TASKS and (task_config or {}).get('enabled', True)
+    }
+
+def serialize_params(params):
+    return json.dumps(params, sort_keys=True)
+
+def is_record_current(record, params, source_size):
+    return record is not None and record['params'] == serialize_params(params) and record['source_size'] == source_size
+
+def _run_ffmpeg(args, interrupt_event):
+    command = ['ffmpeg', '-nostdin', '-y', '-v', 'error'] + args
+    with subprocess_run_context(command) as process:
+        while True:
+            if interrupt_event is not None and interrupt_event.is_set():
+                raise PostprocessCancelled()
+            try:
+                _, stderr = process.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        if process.returncode:
+            raise RuntimeError(stderr.strip() or f"ffmpeg завершился с кодом {process.returncode}")
+
+def extract_audio(file_path, target_path, params, interrupt_event):
+    # Моно 16 кГц WAV (PCM 16 бит) - стандартный вход моделей распознавания речи
+    tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        _run_ffmpeg([
+            '-i', file_path, '-vn',
+            '-ac', str(params.get('channels', 1)),
+            '-ar', str(params.get('sample_rate', 16000)),
+            '-c:a', 'pcm_s16le', '-f', 'wav', tmp_path
+        ], interrupt_event)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def sample_frames(file_path, target_path, params, interrupt_event):
+    video_id = os.path.basename(target_path)
+    image_format = params.get('format', 'jpg')
+    _write_directory(target_path, lambda tmp_dir: _run_ffmpeg([
+        '-i', file_path,
+        '-vf', f"fps={params.get('fps', 1)}",
+        '-q:v', str(params.get('quality', 2)),
+        os.path.join(tmp_dir, f"{video_id}_%06d.{image_format}")
+    ], interrupt_event))
+
+def make_clips(file_path, target_path, params, interrupt_event):
+    video_id = os.path.basename(target_path)
+    length = params.get('length', 10)
+    if params.get('reencode', True):
+        # Ключевые кадры ставятся ровно на границах клипов, поэтому все клипы (кроме последнего) одной длины
+        codec_args = ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac', '-force_key_frames', f"expr:gte(t,n_forced*{length})"]
+    else:
+        # Без перекодирования нарезка идет по ближайшим ключевым кадрам: быстро, но длина клипов приблизительна
+        codec_args = ['-c', 'copy']
+    _write_directory(target_path, lambda tmp_dir: _run_ffmpeg(
+        ['-i', file_path] + codec_args + [
+            '-f', 'segment', '-segment_time', str(length), '-reset_timestamps', '1',
+            os.path.join(tmp_dir, f"{video_id}_%04d.mp4")
+        ], interrupt_event))
+
+def _write_directory(target_path, write_fn):
+    # Результат из многих файлов собирается во временной папке и заменяет прежний целиком
+    tmp_dir = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        write_fn(tmp_dir)
+        if os.path.isdir(target_path):
+            shutil.rmtree(target_path)
+        os.replace(tmp_dir, target_path)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# Задача -> (функция, шаблон пути результата относительно папки задачи)
+POSTPROCESS_TASKS = {
+    'audio': (extract_audio, '{id}.wav'),
+    'frames': (sample_frames, '{id}'),
+    'clips': (make_clips, '{id}'),
+}
+
+def get_output_path(output_dir, task, video_id):
+    return os.path.join(output_dir, 'postprocess', task, POSTPROCESS_TASKS[task][1].format(id=video_id))
+
+def run_postprocess_task(task, file_path, output_dir, video_id, params, interrupt_event=None):
+    target_path = get_output_path(output_dir, task, video_id)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    POSTPROCESS_TASKS[task][0](file_path, target_path, params, interrupt_event)
+    return os.path.relpath(target_path, output_dir)
@@ -0,0 +1,87 @@
+import os
+import json
+import sqlite3
+import multiprocessing
+from .file_utils import get_cache_dir
+from .job_queue import get_journal_mode
+
+# Постоянный кэш результатов ffprobe. Ключ - (путь, размер, mtime_ns):
+# если файл изменился, запись считается устаревшей и перезаписывается.
+# Счетчики попаданий/промахов разделяются между процессами пула.
+_connections = {}
+_counters = {'hits': None, 'misses': None}
+
+def create_probe_cache_counters():
+    return multiprocessing.Value('i', 0), multiprocessing.Value('i', 0)
+
+def set_probe_cache_counters(hits, misses):
+    _counters['hits'] = hits
+    _counters['misses'] = misses
+
+def get_probe_cache_stats():
+    return tuple(counter.value if counter is not None else 0 for counter in (_counters['hits'], _counters['misses']))
+
+def _increment(name):
+    counter = _counters[name]
+    if counter is not None:
+        with counter.get_lock():
+            counter.value += 1
+
+def is_probe_cache_enabled(config):
+    return config.get('probe_cache', {}).get('enabled', True)
+
+def _get_connection(config):
+    db_path = config.get('probe_cache', {}).get('path') or os.path.join(get_cache_dir(config), 'probe_cache.sqlite')
+    # Соединение открывается один раз на процесс (после fork соединение родителя не используется)
+    key = (os.getpid(), db_path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=60)
+        conn.execute(f'PRAGMA journal_mode={get_journal_mode(config)}')
+        conn.execute('CREATE TABLE IF NOT EXISTS probe_cache (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, result TEXT NOT NULL)')
+        # Результаты проверки целостности библиотеки; ключ дополнительно включает ожидаемые значения из метаданных
+        conn.execute('CREATE TABLE IF NOT EXISTS verify_cache (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, expected TEXT NOT NULL, result TEXT NOT NULL)')
+        conn.commit()
+        _connections[key] = conn
+    return conn
+
+def lookup_probe_cache(file_path, stat, config):
+    conn = _get_connection(config)
+    row = conn.execute('SELECT size, mtime_ns, result FROM probe_cache WHERE path = ?', (os.path.abspath(file_path),)).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        _increment('hits')
+        return json.loads(row[2])
+    _increment('misses')
+    return None
+
+def store_probe_cache(file_path, stat, result, config):
+    conn = _get_connection(config)
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, result) VALUES (?, ?, ?, ?)',
+            (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, json.dumps(result))
+        )
+
+def invalidate_probe_cache(file_path, config):
+    conn = _get_connection(config)
+    with conn:
+        conn.execute('DELETE FROM probe_cache WHERE path = ?', (os.path.abspath(file_path),))
+
+def lookup_verify_cache(file_path, stat, expected, config):
+    conn = _get_connection(config)
+    row = conn.execute('SELECT size, mtime_ns, expected, result FROM verify_cache WHERE path = ?', (os.path.abspath(file_path),)).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns and row[2] == json.dumps(expected, sort_keys=True):
+        return json.loads(row[3])
+    return None
+
+def store_verify_cache_batch(entries, config):
+    # entries: [(путь, stat, ожидаемые значения, результат)]
+    conn = _get_connection(config)
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO verify_cache (path, size, mtime_ns, expected, result) VALUES (?, ?, ?, ?, ?)',
+            [
+                (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, json.dumps(expected, sort_keys=True), json.dumps(result))
+                for file_path, stat, expected, result in entries
+            ]
+        )
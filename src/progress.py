@@ -0,0 +1,140 @@
+import os
+import time
+import queue
+import multiprocessing
+from collections import deque
+
+# Побайтовый прогресс загрузок. Воркеры отправляют в общую очередь короткие кортежи
+# (воркер, id видео, загружено байт, всего байт, завершено), не чаще report_interval
+# на загрузку; родительский процесс суммирует их и обновляет строку состояния
+# не чаще update_interval.
+
+_progress_state = {'queue': None, 'interval': 0.5, 'video_id': None, 'files': {}, 'sent_at': 0.0}
+
+def create_progress_queue():
+    return multiprocessing.Queue()
+
+def set_progress_queue(progress_queue, report_interval=0.5):
+    _progress_state.update(queue=progress_queue, interval=report_interval)
+
+def is_progress_due():
+    # Позволяет не разбирать строку прогресса, если она все равно не будет отправлена
+    return _progress_state['queue'] is not None and time.monotonic() - _progress_state['sent_at'] >= _progress_state['interval']
+
+def report_progress(video_id, filename, downloaded, total):
+    progress_queue = _progress_state['queue']
+    if progress_queue is None:
+        return
+    if _progress_state['video_id'] != video_id:
+        _progress_state.update(video_id=video_id, files={}, sent_at=0.0)
+    # Видео со слиянием скачивается несколькими файлами (видео и аудио); прогресс суммируется по ним
+    _progress_state['files'][filename] = (downloaded or 0, total or 0)
+    now = time.monotonic()
+    if now - _progress_state['sent_at'] < _progress_state['interval']:
+        return
+    _progress_state['sent_at'] = now
+    files = _progress_state['files'].values()
+    progress_queue.put((os.getpid(), video_id, sum(d for d, _ in files), sum(t for _, t in files), None))
+
+def report_progress_done(video_id, success, num_bytes=None):
+    progress_queue = _progress_state['queue']
+    if progress_queue is None:
+        return
+    files = _progress_state['files'].values() if _progress_state['video_id'] == video_id else ()
+    downloaded = num_bytes if num_bytes is not None else sum(d for d, _ in files)
+    progress_queue.put((os.getpid(), video_id, downloaded, sum(t for _, t in files), success))
+    _progress_state.update(video_id=None, files={}, sent_at=0.0)
+
+def format_bytes(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def format_eta(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class ByteProgress:
+    def __init__(self, progress_queue, stage='download', update_interval=0.5, window=10.0):
+        self.queue = progress_queue
+        self.stage = stage
+        self.update_interval = update_interval
+        self.window = window
+        self.active = {}
+        self.completed_bytes = 0
+        self.completed_items = 0
+        self.started = None
+        self.samples = deque()
+        self.rendered_at = 0.0
+
+    def drain(self):
+        while True:
+            try:
+                worker, video_id, downloaded, total, success = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if success is None:
+                self.active[worker] = (video_id, downloaded, total)
+                continue
+            self.active.pop(worker, None)
+            if success:
+                self.completed_bytes += downloaded or total
+                self.completed_items += 1
+
+    def build_status(self, pending_items):
+        now = time.monotonic()
+        downloaded = self.completed_bytes + sum(d for _, d, _ in self.active.values())
+        if downloaded and self.started is None:
+            self.started = now
+        self.samples.append((now, downloaded))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+        # Мгновенная скорость - по скользящему окну, средняя - с момента получения первых байт
+        first_time, first_bytes = self.samples[0]
+        current_speed = (downloaded - first_bytes) / (now - first_time) if now > first_time else 0.0
+        average_speed = downloaded / (now - self.started) if self.started and now > self.started else 0.0
+
+        # Размер еще не начатых видео оценивается по среднему размеру уже загруженных
+        known_totals = [t for _, _, t in self.active.values() if t]
+        if self.completed_items:
+            mean_size = self.completed_bytes / self.completed_items
+        else:
+            mean_size = sum(known_totals) / len(known_totals) if known_totals else 0
+        waiting = pending_items + len(self.active) - len(known_totals)
+        total = self.completed_bytes + sum(known_totals) + waiting * mean_size
+        total = max(total, downloaded)
+
+        speed = current_speed or average_speed
+        eta = (total - downloaded) / speed if speed and mean_size else None
+        return {
+            'downloaded': downloaded,
+            'total': total,
+            'current_speed': current_speed,
+            'average_speed': average_speed,
+            'eta': eta,
+            'workers': dict(self.active),
+        }
+
+    def render(self, bytes_bar, workers_bar, pending_items, force=False):
+        self.drain()
+        now = time.monotonic()
+        if not force and now - self.rendered_at < self.update_interval:
+            return None
+        self.rendered_at = now
+        status = self.build_status(pending_items)
+        bytes_bar.set_description_str(
+            f"Объем: {format_bytes(status['downloaded'])} из ~{format_bytes(status['total'])}, "
+            f"{format_bytes(status['current_speed'])}/s (в среднем {format_bytes(status['average_speed'])}/s), "
+            f"осталось {format_eta(status['eta'])}"
+        )
+        workers = [
+            f"{video_id} {downloaded * 100 / total:.0f}%" if total else f"{video_id} {format_bytes(downloaded)}"
+            for video_id, downloaded, total in status['workers'].values()
+        ]
+        workers_bar.set_description_str('Воркеры: ' + (' | '.join(workers) if workers else '-'))
+        return status
@@ -0,0 +1,58 @@
+import time
+import multiprocessing
+
+# Ограничители частоты запросов к платформам, общие для родительского процесса и всех воркеров
+_limiters = {}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        # [доступные токены, время последнего пополнения]; блокировка массива общая для всех процессов
+        self.state = multiprocessing.Array('d', [self.burst, time.monotonic()])
+
+    def _refill(self, now):
+        tokens, updated = self.state[0], self.state[1]
+        self.state[0] = min(self.burst, tokens + (now - updated) * self.rate)
+        self.state[1] = now
+
+    def acquire(self, interrupt_event=None):
+        while True:
+            with self.state.get_lock():
+                now = time.monotonic()
+                self._refill(now)
+                if self.state[0] >= 1:
+                    self.state[0] -= 1
+                    return True
+                wait = (1 - self.state[0]) / self.rate
+            if interrupt_event is not None and interrupt_event.is_set():
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def penalize(self, seconds):
+        # После ответа 429/403 все процессы делают паузу: токены уходят в минус
+        with self.state.get_lock():
+            self._refill(time.monotonic())
+            self.state[0] = min(self.state[0], -self.rate * seconds)
+
+def create_rate_limiters(config):
+    limiters = {}
+    for platform, settings in (config.get('rate_limit') or {}).items():
+        if settings and settings.get('rate'):
+            limiters[platform] = TokenBucket(settings['rate'], settings.get('burst', 1))
+    return limiters
+
+def set_rate_limiters(limiters):
+    _limiters.clear()
+    _limiters.update(limiters)
+
+def acquire_rate_limit(platform, interrupt_event=None):
+    limiter = _limiters.get(platform)
+    if limiter is None:
+        return True
+    return limiter.acquire(interrupt_event)
+
+def penalize_rate_limit(platform, seconds):
+    limiter = _limiters.get(platform)
+    if limiter is not None:
+        limiter.penalize(seconds)
@@ -0,0 +1,373 @@
+import time
+import heapq
+import queue
+import random
+from collections import deque
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import RunMetrics
+
+class PriorityReady:
+    # Очередь готовых задач стадии с тем же интерфейсом, что у deque (append, popleft, [0], len),
+    # но задача с наибольшим приоритетом выходит первой; при равном приоритете - в порядке поступления
+    def __init__(self, priority):
+        self.priority = priority
+        self.heap = []
+        self.counter = 0
+
+    def append(self, job):
+        self.counter += 1
+        heapq.heappush(self.heap, (-self.priority(job), self.counter, job))
+
+    def popleft(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __getitem__(self, index):
+        # Доступен только первый элемент очереди
+        if index != 0:
+            raise IndexError(index)
+        return self.heap[0][2]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (job for _, _, job in self.heap)
+
+# Глобальный планировщик-конвейер: плейлисты перечисляются параллельно в потоках,
+# а задачи (плейлист, видео) проходят через стадии, у каждой из которых свой
+# долгоживущий пул процессов и свой лимит параллельности. Фиксация результатов
+# выполняется в родительском процессе.
+#
+# Задача - словарь; воркер стадии возвращает его с заполненным ключом 'next':
+# имя следующей стадии, 'commit' (фиксация в родителе), 'retry' (повтор стадии
+# 'retry_stage' после паузы), 'wait' (повтор 'retry_stage' через 'wait_delay' с без
+# расхода попыток), 'dead' (неустранимая ошибка) или 'done' (задача завершена).
+class DownloadScheduler:
+    def __init__(self, config, logger, interrupt_event):
+        self.config = config
+        self.logger = logger
+        self.interrupt_event = interrupt_event
+        # {id источника: источник}; завершенные источники при долгой работе удаляются
+        self.sources = {}
+        self.source_counter = 0
+        self.unfinished = set()
+        self.succeeded = 0
+        self.completed = 0
+        self.stages = {}
+        self.stage_order = []
+        self.events = queue.Queue()
+        self.queue_size = config.get('stage_queue_size', 8)
+        self.retry_config = config.get('retry', {})
+        self.retries = []
+        self.retry_counter = 0
+        self.dead_letters = []
+        self.metrics = RunMetrics()
+        # Необязательный побайтовый индикатор (progress.ByteProgress) для одной из стадий
+        self.byte_progress = None
+        # Необязательный внешний источник пачек задач (distributed.DistributedFeed), опрашиваемый в цикле
+        self.feed = None
+        # Необязательный допуск задач одной из стадий по свободному месту (admission.DiskSpaceAdmission)
+        self.admission = None
+        # Долгая работа (режим наблюдения): завершенные источники вместе с результатами удаляются после фиксации
+        self.drop_finished_sources = False
+        # Необязательное периодическое сохранение состояния (отчет, список незагруженных видео) раз в checkpoint_interval с
+        self.checkpoint = None
+        self.checkpoint_interval = 300
+        self.checkpoint_at = time.monotonic()
+
+    def add_stage(self, name, worker, processes, initializer=None, initargs=(), priority=None):
+        # priority(job) -> число: задачи стадии раздаются от большего приоритета к меньшему, иначе в порядке поступления
+        self.stages[name] = {
+            'worker': worker,
+            'processes': processes,
+            'initializer': initializer,
+            'initargs': initargs,
+            'pool': None,
+            'ready': PriorityReady(priority) if priority is not None else deque(),
+            'in_flight': 0,
+        }
+        self.stage_order.append(name)
+
+    def add_source(self, output_dir, enumerate_fn, prepare_fn, commit_fn, finalize_fn, done_fn=None):
+        # enumerate_fn() -> список URL видео
+        # prepare_fn(video_urls) -> список задач, у каждой задан 'next'
+        # commit_fn(job) -> результат (success, metadata), выполняется в родительском процессе
+        # finalize_fn(results) вызывается, когда все задачи источника завершены
+        # done_fn(job) вызывается для каждой завершенной задачи
+        source_id = self.source_counter
+        self.source_counter += 1
+        self.sources[source_id] = {
+            'id': source_id,
+            'output_dir': output_dir,
+            'enumerate': enumerate_fn,
+            'prepare': prepare_fn,
+            'commit': commit_fn,
+            'finalize': finalize_fn,
+            'done': done_fn,
+            'enumerated': False,
+            'pending': 0,
+            'results': [],
+        }
+        self.unfinished.add(source_id)
+        return source_id
+
+    def add_batch(self, output_dir, video_urls, prepare_fn, commit_fn, finalize_fn, done_fn=None):
+        # Источник с уже известным списком видео, добавляемый во время работы планировщика
+        source_id = self.add_source(output_dir, None, prepare_fn, commit_fn, finalize_fn, done_fn)
+        self.events.put(('enumerated', source_id, video_urls))
+        return source_id
+
+    def _enumerate(self, source_id):
+        source = self.sources[source_id]
+        try:
+            with self.metrics.measure('enumeration'):
+                video_urls = source['enumerate']() or []
+        except Exception as e:
+            self.logger.error(f"Ошибка при получении списка видео для {source['output_dir']}: {e}")
+            video_urls = []
+        self.events.put(('enumerated', source_id, video_urls))
+
+    def _has_room(self, name):
+        stage = self.stages[name]
+        if stage['in_flight'] >= stage['processes']:
+            return False
+        # Обратное давление: стадия не берет новые задачи, пока следующие стадии перегружены
+        for downstream in self.stage_order[self.stage_order.index(name) + 1:]:
+            other = self.stages[downstream]
+            if len(other['ready']) + other['in_flight'] >= other['processes'] + self.queue_size:
+                return False
+        return True
+
+    def _dispatch(self):
+        for name in reversed(self.stage_order):
+            stage = self.stages[name]
+            while stage['ready'] and self._has_room(name):
+                if not self._admit(name, stage['ready'][0]):
+                    break
+                job = stage['ready'].popleft()
+                stage['in_flight'] += 1
+                self._record_queue_wait(job, name)
+                stage['pool'].apply_async(
+                    stage['worker'], (job,),
+                    callback=lambda result, name=name: self.events.put(('stage_done', name, result)),
+                    error_callback=lambda error, name=name, job=job: self.events.put(('stage_failed', name, (job, error)))
+                )
+
+    def _admit(self, name, job):
+        return self.admission is None or self.admission.stage != name or self.admission.admit(job)
+
+    def _release(self, name, job):
+        if self.admission is not None and self.admission.stage == name:
+            self.admission.release(job)
+
+    def _enqueue(self, name, job):
+        job['ready_at'] = time.monotonic()
+        self.stages[name]['ready'].append(job)
+
+    def _record_queue_wait(self, job, name):
+        wait = time.monotonic() - job.pop('ready_at', time.monotonic())
+        queue_waits = job.setdefault('queue_waits', {})
+        queue_waits[name] = queue_waits.get(name, 0) + wait
+        self.metrics.add_queue_wait(name, wait)
+
+    def _schedule_retry(self, job):
+        attempt = job.get('attempt', 0) + 1
+        job['attempt'] = attempt
+        if attempt >= self.retry_config.get('max_attempts', 4):
+            self.dead_letters.append(job)
+            return False
+
+        # Экспоненциальная задержка со случайным разбросом, чтобы воркеры не повторяли запросы одновременно
+        delay = min(self.retry_config.get('max_delay', 300), self.retry_config.get('base_delay', 5) * 2 ** (attempt - 1))
+        delay = random.uniform(delay / 2, delay)
+        self.retry_counter += 1
+        heapq.heappush(self.retries, (time.monotonic() + delay, self.retry_counter, job))
+        self.logger.info(f"Повторная попытка {attempt} для {job.get('video_url')} через {delay:.0f} с")
+        return True
+
+    def _defer(self, job):
+        # Отложенная задача возвращается в стадию через wait_delay секунд без расхода попыток
+        self.retry_counter += 1
+        heapq.heappush(self.retries, (time.monotonic() + job.pop('wait_delay', 1), self.retry_counter, job))
+
+    def _release_retries(self):
+        now = time.monotonic()
+        while self.retries and self.retries[0][0] <= now:
+            _, _, job = heapq.heappop(self.retries)
+            job['next'] = job['retry_stage']
+            self._enqueue(job['next'], job)
+
+    def _route(self, job, progress):
+        next_stage = job.get('next')
+        if next_stage in self.stages:
+            self._enqueue(next_stage, job)
+            return
+        if next_stage == 'retry' and self._schedule_retry(job):
+            return
+        if next_stage == 'wait':
+            self._defer(job)
+            return
+        if next_stage == 'dead':
+            self.dead_letters.append(job)
+
+        source = self.sources[job['source_id']]
+        if next_stage == 'commit':
+            try:
+                result = source['commit'](job)
+            except Exception as e:
+                self.logger.error(f"Ошибка при фиксации результата {job.get('video_url')}: {e}")
+                result = (False, None)
+        else:
+            result = (job.get('success', False), None)
+
+        job['success'] = result[0]
+        self.completed += 1
+        self.succeeded += 1 if result[0] else 0
+        if source['done'] is not None:
+            source['done'](job)
+        self.metrics.add_job(job)
+        source['pending'] -= 1
+        source['results'].append(result)
+        progress.update(1)
+        self._finalize_if_done(source)
+
+    def _finalize_if_done(self, source):
+        if source['enumerated'] and source['pending'] == 0:
+            self.unfinished.discard(source['id'])
+            self._finalize(source)
+            if self.drop_finished_sources:
+                self.sources.pop(source['id'], None)
+
+    def _finalize(self, source):
+        if source['finalize'] is None:
+            return
+        finalize, source['finalize'] = source['finalize'], None
+        try:
+            finalize(source['results'])
+        except Exception as e:
+            self.logger.error(f"Ошибка при завершении обработки {source['output_dir']}: {e}")
+
+    def _is_finished(self):
+        if self.unfinished:
+            return False
+        return self.feed is None or self.feed.is_finished()
+
+    def _run_checkpoint(self):
+        now = time.monotonic()
+        if self.checkpoint is None or now - self.checkpoint_at < self.checkpoint_interval:
+            return
+        self.checkpoint_at = now
+        try:
+            self.checkpoint()
+        except Exception as e:
+            self.logger.error(f"Ошибка при периодическом сохранении состояния: {e}")
+
+    def _poll_feed(self):
+        if self.feed is None:
+            return
+        # Новые задачи забираются, только когда в первой стадии есть место
+        stage = self.stages[self.stage_order[0]]
+        self.feed.poll(stage['processes'] + self.queue_size - len(stage['ready']) - stage['in_flight'])
+
+    def _handle_event(self, event, key, payload, progress):
+        if event == 'enumerated':
+            source = self.sources[key]
+            try:
+                jobs = source['prepare'](payload)
+            except Exception as e:
+                # Сбой подготовки одного источника не должен останавливать остальные: источник завершается без задач
+                self.logger.error(f"Ошибка при подготовке задач для {source['output_dir']}: {e}")
+                jobs = []
+            progress.total += len(jobs)
+            progress.refresh()
+            for job in jobs:
+                job['source_id'] = key
+                source['pending'] += 1
+                self._route(job, progress)
+            source['enumerated'] = True
+            self._finalize_if_done(source)
+        elif event == 'stage_done':
+            self.stages[key]['in_flight'] -= 1
+            self._release(key, payload)
+            self._route(payload, progress)
+        elif event == 'stage_failed':
+            job, error = payload
+            self.stages[key]['in_flight'] -= 1
+            self._release(key, job)
+            self.logger.error(f"Ошибка в процессе-воркере стадии {key}: {error}")
+            job.update(next='done', success=False)
+            self._route(job, progress)
+
+    def _pending_in_stage(self, name):
+        pending = sum(1 for job in self.stages[name]['ready'] if job.get('action') != 'info')
+        pending += sum(1 for _, _, job in self.retries if job.get('retry_stage') == name)
+        return pending
+
+    def _render_byte_progress(self, status_bars, force=False):
+        if self.byte_progress is not None:
+            self.byte_progress.render(*status_bars, self._pending_in_stage(self.byte_progress.stage), force=force)
+
+    def _terminate_pools(self):
+        for stage in self.stages.values():
+            if stage['pool'] is not None:
+                stage['pool'].terminate()
+
+    def run(self):
+        from tqdm import tqdm
+        enumeration_workers = self.config.get('enumeration_workers', 4)
+
+        progress = tqdm(total=0, desc="Загрузка видео", ncols=70)
+        status_bars = []
+        if self.byte_progress is not None:
+            status_bars = [tqdm(total=0, position=position, bar_format='{desc}') for position in (1, 2)]
+        for stage in self.stages.values():
+            stage['pool'] = Pool(processes=stage['processes'], initializer=stage['initializer'], initargs=stage['initargs'])
+        enumerator = ThreadPoolExecutor(max_workers=enumeration_workers)
+        try:
+            for source_id, source in list(self.sources.items()):
+                if source['enumerate'] is not None:
+                    enumerator.submit(self._enumerate, source_id)
+
+            while not self._is_finished():
+                if self.interrupt_event.is_set():
+                    self.logger.info("Прерывание загрузки...")
+                    self._terminate_pools()
+                    break
+                self._release_retries()
+                self._run_checkpoint()
+                self._poll_feed()
+                self._dispatch()
+                self._render_byte_progress(status_bars)
+                try:
+                    event, key, payload = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self._handle_event(event, key, payload, progress)
+                # Обрабатываем накопившиеся события пачкой перед следующей раздачей задач
+                while True:
+                    try:
+                        event, key, payload = self.events.get_nowait()
+                    except queue.Empty:
+                        break
+                    self._handle_event(event, key, payload, progress)
+        except KeyboardInterrupt:
+            self.logger.info("Получено прерывание клавиатуры. Завершаем работу пулов процессов...")
+            self._terminate_pools()
+        finally:
+            enumerator.shutdown(wait=False, cancel_futures=True)
+            self._render_byte_progress(status_bars, force=True)
+            for status_bar in status_bars:
+                status_bar.close()
+            progress.close()
+            for stage in self.stages.values():
+                stage['pool'].close()
+                stage['pool'].join()
+
+        # После прерывания сохраняем результаты уже завершенных задач
+        for source in self.sources.values():
+            if source['results']:
+                self._finalize(source)
+
+        results = [result for source in self.sources.values() for result in source['results']]
+        return results
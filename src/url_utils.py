@@ -1,7 +1,24 @@
 from urllib.parse import parse_qs, urlparse
 import re
-import requests
-from bs4 import BeautifulSoup
+import threading
+
+# Общая сессия с пулом соединений для всех HTTP запросов процесса
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            # requests импортируется только процессами, которые делают HTTP запросы
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+    return _http_session
 
 def get_video_id(url):
     parsed_url = urlparse(url)
@@ -45,12 +62,13 @@ def read_video_urls(file_path):
 
 def get_rutube_playlist_video_ids(playlist_url, logger):
     try:
-        response = requests.get(playlist_url)
+        response = get_http_session().get(playlist_url, timeout=30)
         if response.status_code != 200:
             logger.error(f"Не удалось получить страницу плейлиста: {response.status_code}")
             return []
         logger.info(f"Страница плейлиста успешно получена: {playlist_url}")
 
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.content, 'html.parser')
 
         video_ids = []
@@ -0,0 +1,181 @@
+import os
+import csv
+import json
+import uuid
+from multiprocessing import Pool
+from .logging_utils import setup_logging, start_log_listener, stop_log_listener, set_log_queue
+from .file_utils import verify_media_file
+from .metadata_utils import get_file_metadata
+from .metadata_store import load_dir_metadata
+from .probe_cache import lookup_verify_cache, store_verify_cache_batch
+
+# Проверка целостности библиотеки: каждый файл папок плейлистов проверяется на целостность
+# контейнера и читаемость, а длительность сравнивается с video_metadata.csv и {id}_metadata.json,
+# а если их нет или в них нет значения - с базой метаданных.
+# Проверка идет пулом процессов; результат кэшируется по (путь, размер, время изменения),
+# поэтому повторная проверка большой библиотеки затрагивает только изменившиеся файлы.
+
+MEDIA_EXTENSIONS = ('.mp4', '.m4a', '.mov', '.webm', '.mkv')
+# Служебные папки внутри output_dir, которые не являются папками плейлистов
+SKIPPED_DIRS = ('postprocess', 'logs')
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def load_expected_metadata(output_dir, config):
+    # {id: {'file_name', 'duration', 'file_size', 'video_url'}}; отдельные JSON файлы дополняют CSV,
+    # а пустые или отсутствующие значения берутся из базы метаданных
+    expected = {}
+    csv_path = os.path.join(output_dir, 'video_metadata.csv')
+    if os.path.isfile(csv_path):
+        with open(csv_path, 'r', encoding='utf-8-sig') as csvfile:
+            for row in csv.DictReader(csvfile):
+                if row.get('id'):
+                    expected[row['id']] = row
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('_metadata.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if metadata.get('id'):
+                expected.setdefault(metadata['id'], {}).update(metadata)
+    for row in load_dir_metadata(output_dir, config):
+        metadata = expected.setdefault(row['id'], {})
+        for field in ('file_name', 'duration', 'file_size', 'video_url'):
+            if metadata.get(field) in (None, '', 'N/A'):
+                metadata[field] = row.get(field)
+    return {
+        video_id: {
+            'file_name': metadata.get('file_name'),
+            'duration': _to_float(metadata.get('duration')),
+            'file_size': _to_int(metadata.get('file_size')),
+            'video_url': metadata.get('video_url'),
+        }
+        for video_id, metadata in expected.items()
+    }
+
+def get_library_dirs(config):
+    output_dir = config['output_dir']
+    with os.scandir(output_dir) as entries:
+        return sorted(entry.path for entry in entries if entry.is_dir() and not entry.name.startswith('.') and entry.name not in SKIPPED_DIRS)
+
+def collect_verify_tasks(library_dir, config):
+    # Задачи (id, путь, ожидаемые значения, URL): файлы из метаданных и файлы без записи в метаданных
+    expected = load_expected_metadata(library_dir, config)
+    with os.scandir(library_dir) as entries:
+        media_files = {os.path.splitext(entry.name)[0]: entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith(MEDIA_EXTENSIONS)}
+    tasks = []
+    for video_id, metadata in expected.items():
+        file_name = metadata['file_name'] or media_files.get(video_id)
+        file_path = os.path.join(library_dir, file_name) if file_name else None
+        tasks.append((video_id, file_path, {'duration': metadata['duration'], 'file_size': metadata['file_size']}, metadata['video_url']))
+    for video_id, file_name in media_files.items():
+        if video_id not in expected:
+            tasks.append((video_id, os.path.join(library_dir, file_name), {'duration': None, 'file_size': None}, None))
+    return tasks
+
+def init_verify_worker(log_queue, config):
+    set_log_queue(log_queue, config)
+
+def verify_file(task):
+    file_path, expected, config = task
+    try:
+        file_size = os.path.getsize(file_path)
+    except OSError:
+        return {'status': 'missing'}
+    if expected['file_size'] and file_size < expected['file_size']:
+        return {'status': 'truncated', 'reason': f"размер {file_size} меньше записанного {expected['file_size']}"}
+    if not verify_media_file(file_path):
+        return {'status': 'truncated', 'reason': 'контейнер обрезан или поврежден'}
+
+    duration = _to_float(get_file_metadata(file_path, config).get('duration'))
+    if duration is None:
+        return {'status': 'unreadable', 'reason': 'ffprobe не смог прочитать длительность'}
+    tolerance = config.get('verify', {}).get('duration_tolerance', 2.0)
+    if expected['duration'] is not None and abs(duration - expected['duration']) > tolerance:
+        return {'status': 'duration_mismatch', 'duration': duration, 'reason': f"длительность {duration:.1f} с вместо {expected['duration']:.1f} с"}
+    return {'status': 'ok', 'duration': duration}
+
+def write_url_list(video_urls, file_path):
+    # Формат video_urls.txt: по одному URL в строке
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for video_url in video_urls:
+            f.write(f"{video_url}\n")
+    os.replace(tmp_path, file_path)
+
+def verify_library(config):
+    logger = setup_logging(config)
+    verify_config = config.get('verify', {})
+    tasks = [task for library_dir in get_library_dirs(config) for task in collect_verify_tasks(library_dir, config)]
+    logger.info(f"Проверка библиотеки {config['output_dir']}: {len(tasks)} файлов")
+
+    results = {}
+    pending = []
+    from_cache = 0
+    for index, (video_id, file_path, expected, video_url) in enumerate(tasks):
+        stat = None
+        if file_path:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                pass
+        if stat is None:
+            results[index] = {'status': 'missing'}
+            continue
+        cached = lookup_verify_cache(file_path, stat, expected, config)
+        if cached is not None:
+            results[index] = cached
+            from_cache += 1
+        else:
+            pending.append((index, stat))
+    logger.info(f"Из кэша проверки: {from_cache}, не найдено: {len(tasks) - len(pending) - from_cache}, к проверке: {len(pending)}")
+
+    if pending:
+        log_queue = start_log_listener(config)
+        try:
+            pool = Pool(processes=verify_config.get('workers') or os.cpu_count(), initializer=init_verify_worker, initargs=(log_queue, config))
+            try:
+                checked = pool.imap(verify_file, [(tasks[index][1], tasks[index][2], config) for index, _ in pending], chunksize=16)
+                cache_entries = []
+                for (index, stat), result in zip(pending, checked):
+                    results[index] = result
+                    cache_entries.append((tasks[index][1], stat, tasks[index][2], result))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            stop_log_listener()
+        store_verify_cache_batch(cache_entries, config)
+
+    flagged = []
+    counts = {}
+    for index, (video_id, file_path, expected, video_url) in enumerate(tasks):
+        result = results[index]
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if result['status'] != 'ok':
+            flagged.append(video_url)
+            logger.warning(f"Видео {video_id} ({file_path or 'файл не найден'}): {result['status']}" + (f" - {result['reason']}" if result.get('reason') else ''))
+    logger.info('Результат проверки: ' + ', '.join(f"{status}: {count}" for status, count in sorted(counts.items())))
+
+    urls = sorted({video_url for video_url in flagged if video_url})
+    if len(urls) < len(flagged):
+        logger.warning(f"Для {len(flagged) - len(urls)} файлов нет URL в метаданных: они не попадут в список для повторной загрузки")
+    if urls:
+        failed_path = verify_config.get('failed_urls_file') or os.path.join(config['output_dir'], 'verify_failed_urls.txt')
+        write_url_list(urls, failed_path)
+        logger.info(f"Список видео для повторной загрузки сохранен в файл: {failed_path}")
+    return counts
@@ -0,0 +1,152 @@
+import os
+import time
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .url_utils import get_playlist_id, read_video_urls
+from .enumeration import enumerate_playlist
+
+# Режим наблюдения: один запуск планировщика работает до SIGTERM/SIGINT, пулы процессов и кэши
+# остаются прогретыми. Файл со списком URL перечитывается при изменении: новые отдельные видео
+# сразу ставятся в очередь, новые плейлисты - на опрос. Каждый плейлист опрашивается по своему
+# расписанию, и в планировщик попадают только видео, которых еще не было в его списке.
+# Новые видео ждут в очереди наблюдения и передаются планировщику по мере освобождения мест
+# в первой стадии, как и задачи общей очереди в распределенном режиме.
+class WatchFeed:
+    def __init__(self, config, logger, urls_file, add_batch_fn):
+        watch_config = config.get('watch', {})
+        # При опросе список видео запрашивается заново, а не берется из кэша перечисления
+        self.config = dict(config, enumeration=dict(config.get('enumeration', {}), cache_ttl=0))
+        self.logger = logger
+        self.urls_file = urls_file
+        self.use_playlists = config['use_playlists']
+        self.output_dir = config['output_dir']
+        # add_batch_fn(output_dir, video_urls, estimates) добавляет пачку задач в планировщик
+        self.add_batch_fn = add_batch_fn
+        self.file_check_interval = watch_config.get('file_check_interval', 5)
+        self.playlist_interval = watch_config.get('playlist_interval', 900)
+        self.playlist_intervals = watch_config.get('playlist_intervals') or {}
+        self.file_state = None
+        self.checked_at = 0.0
+        # {URL плейлиста: {'output_dir', 'interval', 'next_poll', 'polling', 'seen'}}
+        self.playlists = {}
+        self.seen_videos = set()
+        # Пачки (output_dir, URL видео, оценки), еще не переданные планировщику
+        self.pending = deque()
+        # Пачка передается, когда свободно не меньше release_size мест: по одному видео на пачку
+        # фиксация метаданных и выгрузка CSV выполнялись бы для каждого видео отдельно
+        self.release_size = max(1, config.get('stage_queue_size', 8))
+        self.queued_total = 0
+        self.enumerated = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=config.get('enumeration_workers', 4))
+
+    def start(self):
+        self.logger.info(f"Режим наблюдения: отслеживается файл {self.urls_file}")
+
+    def stop(self, interrupted=False):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _read_urls_file(self):
+        try:
+            stat = os.stat(self.urls_file)
+        except OSError:
+            return None
+        file_state = (stat.st_mtime_ns, stat.st_size)
+        if file_state == self.file_state:
+            return None
+        self.file_state = file_state
+        return read_video_urls(self.urls_file)
+
+    def _check_urls_file(self):
+        urls = self._read_urls_file()
+        if urls is None:
+            return
+        if not self.use_playlists:
+            new_urls = [video_url for video_url in dict.fromkeys(urls) if video_url not in self.seen_videos]
+            if new_urls:
+                self.seen_videos.update(new_urls)
+                self.logger.info(f"В файле {self.urls_file} новых видео: {len(new_urls)}")
+                individual_videos_dir = os.path.join(self.output_dir, 'individual_videos')
+                os.makedirs(individual_videos_dir, exist_ok=True)
+                self._add_batch(individual_videos_dir, new_urls, {})
+            return
+
+        for playlist_url in urls:
+            if playlist_url in self.playlists:
+                continue
+            platform, playlist_id = get_playlist_id(playlist_url)
+            if not playlist_id:
+                self.logger.warning(f"Некорректный URL плейлиста: {playlist_url}")
+                continue
+            self.playlists[playlist_url] = {
+                'output_dir': os.path.join(self.output_dir, playlist_id),
+                'interval': self.playlist_intervals.get(playlist_id, self.playlist_interval),
+                'next_poll': 0.0,
+                'polling': False,
+                'seen': set(),
+            }
+            self.logger.info(f"Плейлист {playlist_url} добавлен в наблюдение (опрос каждые {self.playlists[playlist_url]['interval']} с)")
+        for playlist_url in set(self.playlists) - set(urls):
+            # Видео плейлиста, уже поставленные в очередь, будут обработаны; новые опросы не выполняются
+            del self.playlists[playlist_url]
+            self.logger.info(f"Плейлист {playlist_url} удален из файла и больше не опрашивается")
+
+    def _enumerate(self, playlist_url, output_dir):
+        estimates = {}
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            video_urls = enumerate_playlist(playlist_url, self.config, self.logger, estimates)
+        except Exception as e:
+            self.logger.error(f"Ошибка при опросе плейлиста {playlist_url}: {e}")
+            video_urls = []
+        self.enumerated.put((playlist_url, video_urls, estimates))
+
+    def _add_batch(self, output_dir, video_urls, estimates):
+        self.pending.append((output_dir, video_urls, estimates))
+
+    def _release_pending(self, free_slots):
+        # В планировщик уходит не больше видео, чем свободных мест; остаток пачки ждет следующего опроса
+        while self.pending and free_slots >= min(self.release_size, len(self.pending[0][1])):
+            output_dir, video_urls, estimates = self.pending.popleft()
+            if len(video_urls) > free_slots:
+                self.pending.appendleft((output_dir, video_urls[free_slots:], estimates))
+                video_urls = video_urls[:free_slots]
+            free_slots -= len(video_urls)
+            self.queued_total += len(video_urls)
+            self.add_batch_fn(output_dir, video_urls, {video_url: estimates[video_url] for video_url in video_urls if video_url in estimates})
+
+    def _drain_enumerated(self):
+        while True:
+            try:
+                playlist_url, video_urls, estimates = self.enumerated.get_nowait()
+            except queue.Empty:
+                break
+            playlist = self.playlists.get(playlist_url)
+            if playlist is None:
+                continue
+            playlist['polling'] = False
+            playlist['next_poll'] = time.monotonic() + playlist['interval']
+            new_urls = [video_url for video_url in video_urls if video_url not in playlist['seen']]
+            if not new_urls:
+                continue
+            # Первый опрос отдает весь плейлист: уже загруженные видео отсеет инкрементальная синхронизация
+            self.logger.info(f"Плейлист {playlist_url}: новых видео {len(new_urls)}")
+            playlist['seen'].update(new_urls)
+            self._add_batch(playlist['output_dir'], new_urls, estimates)
+
+    def poll(self, free_slots):
+        # Вызывается в цикле планировщика; перечисление плейлистов идет в потоках, не задерживая раздачу задач
+        now = time.monotonic()
+        if now - self.checked_at >= self.file_check_interval:
+            self.checked_at = now
+            self._check_urls_file()
+        for playlist_url, playlist in self.playlists.items():
+            if not playlist['polling'] and now >= playlist['next_poll']:
+                playlist['polling'] = True
+                self.executor.submit(self._enumerate, playlist_url, playlist['output_dir'])
+        self._drain_enumerated()
+        self._release_pending(free_slots)
+
+    def is_finished(self):
+        # Работа продолжается до сигнала остановки
+        return False
@@ -0,0 +1,132 @@
+import os
+import time
+from .logging_utils import get_component_logger
+from .progress import report_progress
+from .fragment_budget import get_fragment_concurrency
+
+# "Прогретые" экземпляры YoutubeDL, живущие все время жизни процесса-воркера.
+# Ключ - строка формата, чтобы не пересоздавать экстракторы для каждого видео.
+_ydl_instances = {}
+
+class DownloadCancelled(Exception):
+    pass
+
+def import_yt_dlp():
+    # yt_dlp импортируется при первом использовании: команды планирования и воркеры других стадий его не загружают
+    import yt_dlp
+    return yt_dlp
+
+# Состояние текущей загрузки в воркере, которое читает общий progress hook
+_download_state = {'interrupt_event': None, 'logger': None, 'timings': None, 'ydl': None}
+
+def build_format_string(video_quality):
+    if video_quality:
+        height = video_quality[:-1]
+        return f"bestvideo[height<={height}]+bestaudio/best[height<={height}]"
+    return "bestvideo+bestaudio/best"
+
+def build_ydl_opts(format_string):
+    # Соответствует флагам CLI: --continue --merge-output-format mp4 --no-warnings
+    # Недокачанные данные остаются в .part файлах и докачиваются при следующем запуске
+    ydl_opts = {
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': True,
+        'continuedl': True,
+        'nopart': False,
+        'merge_output_format': 'mp4',
+        # Сообщения и ошибки yt-dlp идут в общий конвейер логирования (компонент ytdlp)
+        'logger': get_component_logger('ytdlp'),
+    }
+    if format_string:
+        ydl_opts['format'] = format_string
+    return ydl_opts
+
+def get_youtube_dl(format_string=None, info_extractors=None):
+    ydl = _ydl_instances.get(format_string)
+    if ydl is None:
+        # Собственные экстракторы (например, локальный фейковый) регистрируются вместо стандартных
+        ydl = import_yt_dlp().YoutubeDL(build_ydl_opts(format_string), auto_init=not info_extractors)
+        for ie in info_extractors or ():
+            ydl.add_info_extractor(ie)
+        ydl.add_progress_hook(_progress_hook)
+        ydl.add_postprocessor_hook(_postprocessor_hook)
+        _ydl_instances[format_string] = ydl
+    return ydl
+
+def _progress_hook(status):
+    interrupt_event = _download_state['interrupt_event']
+    if interrupt_event is not None and interrupt_event.is_set():
+        raise import_yt_dlp().utils.DownloadCancelled('Загрузка прервана пользователем')
+    if status.get('status') == 'downloading':
+        report_progress(status.get('info_dict', {}).get('id'), status.get('filename'), status.get('downloaded_bytes'), status.get('total_bytes') or status.get('total_bytes_estimate'))
+    timings = _download_state['timings']
+    if timings is not None:
+        timings.setdefault('download_started', time.perf_counter())
+        if status.get('status') == 'finished':
+            timings['bytes'] = timings.get('bytes', 0) + (status.get('total_bytes') or status.get('downloaded_bytes') or 0)
+    ydl = _download_state['ydl']
+    if ydl is not None and status.get('status') == 'finished':
+        # Следующий формат (например, аудио после видео) загружается с долей бюджета на текущий момент
+        _apply_fragment_concurrency(ydl, rebalance=True)
+    logger = _download_state['logger']
+    if logger and status.get('status') == 'finished':
+        logger.debug(f"Destination: {status.get('filename')}")
+
+def _postprocessor_hook(status):
+    timings = _download_state['timings']
+    if timings is not None and status.get('postprocessor') == 'Merger':
+        timings[f"merge_{status.get('status')}"] = time.perf_counter()
+
+def _apply_fragment_concurrency(ydl, rebalance=False):
+    concurrency = get_fragment_concurrency(rebalance)
+    if concurrency:
+        ydl.params['concurrent_fragment_downloads'] = concurrency
+
+def close_engine():
+    for ydl in _ydl_instances.values():
+        ydl.close()
+    _ydl_instances.clear()
+
+def extract_video_info(video_url):
+    ydl = get_youtube_dl()
+    return ydl.extract_info(video_url, download=False)
+
+def extract_playlist_entries(playlist_url):
+    # Плоское перечисление плейлиста без захода в каждое видео (аналог --flat-playlist)
+    ydl_opts = {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist'}
+    with import_yt_dlp().YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+    return list(info.get('entries') or [])
+
+# Загружает видео внутри текущего процесса и возвращает (путь к файлу, info dict)
+# Если передан словарь timings, в него записываются длительности extract_info, download, merge и объем загрузки
+def download_with_engine(video_url, output_template, format_string, interrupt_event, logger, timings=None):
+    ydl = get_youtube_dl(format_string)
+    ydl.params['outtmpl']['default'] = output_template
+    _apply_fragment_concurrency(ydl)
+    marks = {}
+    _download_state.update(interrupt_event=interrupt_event, logger=logger, timings=marks, ydl=ydl)
+    start = time.perf_counter()
+    try:
+        info = ydl.extract_info(video_url, download=True)
+    except import_yt_dlp().utils.DownloadCancelled as e:
+        raise DownloadCancelled(str(e)) from e
+    finally:
+        _download_state.update(interrupt_event=None, logger=None, timings=None, ydl=None)
+        end = time.perf_counter()
+        if timings is not None:
+            download_started = marks.get('download_started', end)
+            merge_started = marks.get('merge_started', end)
+            timings['extract_info'] = download_started - start
+            timings['download'] = min(merge_started, end) - download_started
+            timings['merge'] = marks.get('merge_finished', merge_started) - merge_started
+            timings['bytes'] = marks.get('bytes', 0)
+
+    file_path = None
+    requested_downloads = info.get('requested_downloads') or []
+    if requested_downloads:
+        file_path = requested_downloads[-1].get('filepath')
+    if not file_path or not os.path.exists(file_path):
+        file_path = None
+    return file_path, info